@@ -4,6 +4,7 @@ import concurrent.futures
 import sys
 import os
 from loguru import logger
+from clientpool import configure_client_pool, get_client
 
 # --- 配置 ---
 BASE_URL = "https://api.toiotech.com/v1" # 确保末尾没有 /
@@ -53,9 +54,8 @@ def check_key_model_openai(api_key, model_name, base_url, use_thinking_params=Fa
     start_time = time.time()
 
     try:
-        client = openai.OpenAI(
-            api_key=api_key,
-            base_url=base_url,
+        # 复用端点共享的长连接池，只覆盖本次检查的超时和重试设置
+        client = get_client(base_url, api_key).with_options(
             timeout=TIMEOUT,
             max_retries=0
         )
@@ -128,6 +128,7 @@ if __name__ == "__main__":
     initial_log.info(f"基础 URL: {BASE_URL}")
     initial_log.info(f"并发数: {MAX_WORKERS}, 超时时间: {TIMEOUT}s")
     initial_log.info("-" * 30)
+    configure_client_pool(max_connections=MAX_WORKERS, max_keepalive_connections=MAX_WORKERS)
 
     tasks = []
     for key in API_KEYS:
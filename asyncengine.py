@@ -0,0 +1,223 @@
+# asyncengine.py
+# 基于 asyncio 的对局引擎：一个事件循环可以同时驱动多局游戏，
+# 模型请求通过 openai.AsyncOpenAI 发出，规则要求顺序的环节（白天轮流发言等）仍按顺序 await。
+import argparse
+import asyncio
+import inspect
+import time
+from DisplayAdapter import DisplayAdapter
+from main import Game, LLMCall, LLMPlayer, LLMPlayerBuilder, StreamReply, TaskGraph
+from hedging import run_hedged_async
+from responsecache import MODES, configure_response_cache
+
+
+class AsyncLLMPlayer(LLMPlayer):
+    """requestSpeech / requestVote 为协程的AI玩家"""
+
+    async def _acall_llm(self, prompt: str, is_print: bool, action: str = "think", response_format: dict = None) -> str:
+        """_call_llm 的协程版本：缓存、路由、熔断、重试和用量统计沿用同步版本的辅助方法，只替换等待的方式"""
+        call, cached = self._start_call(prompt, is_print, action, response_format)
+        if cached is not None:
+            return cached
+        for attempt in range(self.max_retries):
+            endpoint, delay = self._next_endpoint(call, attempt)
+            if endpoint is None:
+                break
+            if delay:
+                await asyncio.sleep(delay)
+            if not self._admit(call, endpoint):
+                continue
+            try:
+                await endpoint.rate_limiter.acquire_async(call.prompt_tokens)
+                endpoint, opened = await run_hedged_async(self._ahedge_starter(endpoint, call), endpoint, self.router,
+                                                          call.tried, self._adiscard_stream, self._record_failure)
+                try:
+                    reply = await self._aread_stream(opened, is_print, action)
+                finally:
+                    endpoint.end()
+                return self._finish_call(call, endpoint, reply)
+            except Exception as e:
+                if not self._call_failed(call, endpoint, e, attempt):
+                    break
+        return ""  # 维持失败返回空字符串
+
+    def _ahedge_starter(self, primary, call: LLMCall):
+        """_hedge_starter 的协程版本"""
+        async def start(endpoint):
+            if endpoint is not primary:
+                await endpoint.rate_limiter.acquire_async(call.prompt_tokens)
+            return await self._aopen_stream(endpoint, self._stream_request(endpoint, call))
+        return start
+
+    async def _aopen_stream(self, endpoint, request: dict):
+        """_open_stream 的协程版本，返回 (流, 从头开始的异步数据块迭代器)"""
+        endpoint.begin()
+        try:
+            started = time.monotonic()
+            stream = await endpoint.async_client.chat.completions.create(**request)
+            chunks = stream.__aiter__()
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                first = None
+        except BaseException:
+            endpoint.end()
+            raise
+        self.router.record_latency(endpoint, time.monotonic() - started)  # 首字延迟，用于路由和对冲
+        return stream, self._prepend(first, chunks)
+
+    @staticmethod
+    async def _prepend(first, chunks):
+        if first is not None:
+            yield first
+        async for chunk in chunks:
+            yield chunk
+
+    async def _adiscard_stream(self, endpoint, opened):
+        """关闭对冲落选的流"""
+        stream, _ = opened
+        if hasattr(stream, "close"):
+            await stream.close()
+        endpoint.end()
+
+    async def _aread_stream(self, opened, is_print: bool, action: str = "think") -> StreamReply:
+        """_read_stream 的协程版本；多局/多玩家同时进行，不逐字打印，整段输出避免交错"""
+        stream, chunks = opened
+        reply = StreamReply()
+        async for chunk in chunks:
+            if self._consume_chunk(reply, chunk, action):
+                if hasattr(stream, "close"):
+                    await stream.close()
+                break
+        self._print_reply(reply, is_print)
+        return reply
+
+    async def _athink_before_action(self) -> str:
+        thinking_prompt = self._build_thinking_prompt()
+        thinking_response = await self._acall_llm(thinking_prompt, is_print=True, action="think")
+        return self._record_thinking(thinking_prompt, thinking_response)
+
+    async def requestSpeech(self, prompt: str) -> str:
+        if self.fused_actions:
+            thinking_prompt = self._build_thinking_prompt()
+            response = await self._acall_llm(self._build_speech_prompt(prompt, thinking_prompt, fused=True),
+                                             is_print=False, action="act", response_format=self._speech_schema())
+            return self._finish_fused_speech(thinking_prompt, response)
+        thinking = await self._athink_before_action()
+        response = await self._acall_llm(self._build_speech_prompt(prompt, thinking), is_print=False, action="speech")
+        return self._clean_speech(response)
+
+    async def requestVote(self, prompt: str, valid_targets: list = None) -> int:
+        if self.fused_actions:
+            thinking_prompt = self._build_thinking_prompt()
+            full_prompt = self._build_vote_prompt(prompt, thinking_prompt, valid_targets, fused=True)
+            response = await self._acall_llm(full_prompt, is_print=False, action="act",
+                                             response_format=self._vote_schema(valid_targets, fused=True))
+            # 多局/多玩家同时进行，标题和投票回复整段输出避免交错
+            print(f"{self._vote_header()}\n{response}")
+            self._record_fused_thinking(thinking_prompt, response)
+            return self._parse_vote(response)
+        thinking = await self._athink_before_action()
+        full_prompt = self._build_vote_prompt(prompt, thinking, valid_targets)
+        response = await self._acall_llm(full_prompt, is_print=False, action="vote",
+                                         response_format=self._vote_schema(valid_targets))
+        print(f"{self._vote_header()}\n{response}")
+        return self._parse_vote(response)
+
+
+class AsyncGame(Game):
+    """Game 的异步版本：规则流程（各阶段的生成器）与 Game 完全相同，这里只替换执行流程请求的方式"""
+
+    async def _arun_steps(self, steps):
+        """_run_steps 的协程版本"""
+        send, value = steps.send, None
+        while True:
+            try:
+                request = send(value)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                value, send = await self._aperform(request), steps.send
+            except Exception as e:
+                value, send = e, steps.throw
+
+    async def _aperform(self, request):
+        """AI玩家的协程直接 await；真人玩家的阻塞输入、保存记录和经验检索等同步调用放到线程里，不阻塞事件循环"""
+        if isinstance(request, TaskGraph):
+            return await self._arun_task_graph(request.tasks, request.parallel)
+        if inspect.iscoroutinefunction(request.func):
+            return await request.func(*request.args)
+        return await asyncio.to_thread(request.func, *request.args)
+
+    async def _arun_task_graph(self, tasks, parallel=True):
+        """_run_task_graph 的协程版本"""
+        results = {}
+        if not parallel:
+            for name, (func, deps) in tasks.items():
+                if not all(dep in results for dep in deps):
+                    raise ValueError(f"任务依赖无法满足：{name}")
+                results[name] = await self._arun_steps(func({dep: results[dep] for dep in deps}))
+            return results
+        pending = dict(tasks)
+        running = {}
+        try:
+            while pending or running:
+                for name, (func, deps) in list(pending.items()):
+                    if all(dep in results for dep in deps):
+                        steps = func({dep: results[dep] for dep in deps})
+                        running[asyncio.ensure_future(self._arun_steps(steps))] = name
+                        del pending[name]
+                if not running:
+                    raise ValueError(f"任务依赖无法满足：{list(pending)}")
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    results[running.pop(task)] = task.result()
+        finally:
+            for task in running:
+                task.cancel()
+        return {name: results[name] for name in tasks}
+
+    async def updateDay(self) -> bool:
+        return await self._arun_steps(self._play_day())
+
+    async def main(self):
+        for player in self.players:
+            player.display = DisplayAdapter(player.number, len(self.players))
+        try:
+            while not await self._arun_steps(self._check_win()):
+                if await self.updateDay():
+                    break
+        except asyncio.CancelledError:
+            print("\n游戏被中断，正在保存聊天记录...")
+            await asyncio.to_thread(self.save_chat_logs)
+            raise
+        except Exception as e:
+            print(f"\n游戏发生错误: {e}")
+            print("正在保存聊天记录...")
+            await asyncio.to_thread(self.save_chat_logs)
+            raise
+
+
+async def run_games(games):
+    """在同一个事件循环里并发运行多局游戏，单局出错不影响其他对局"""
+    results = await asyncio.gather(*(game.main() for game in games), return_exceptions=True)
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            print(f"第 {i + 1} 局游戏异常结束: {result}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="在一个事件循环中并发运行多局狼人杀")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--games", type=int, default=1, help="同时进行的对局数")
+    parser.add_argument("--seed", type=int, help="随机种子，第 i 局使用 seed + i，便于复现对局")
+    parser.add_argument("--cache", choices=MODES, help="模型回复缓存模式，覆盖配置文件中的 response_cache.mode")
+    args = parser.parse_args()
+
+    builder = LLMPlayerBuilder(args.config)
+    if args.cache:
+        configure_response_cache(mode=args.cache)
+    games = [AsyncGame(builder.build_all(None, player_cls=AsyncLLMPlayer),
+                       seed=None if args.seed is None else args.seed + i) for i in range(args.games)]
+    asyncio.run(run_games(games))
@@ -0,0 +1,86 @@
+import asyncio
+import importlib.util
+import threading
+import weakref
+from typing import Dict, Tuple
+import openai
+
+try:
+    import httpx
+except ImportError:  # 较新版本的 openai 依赖 httpx2
+    import httpx2 as httpx
+
+# 连接池配置，可通过 config.json 的 "client_pool" 覆盖
+_pool_settings = {
+    "max_connections": 20,             # 每个端点的最大连接数
+    "max_keepalive_connections": 10,   # 保持长连接的数量
+    "keepalive_expiry": 60.0,          # 空闲连接保留秒数
+    "http2": None,                     # None 表示安装了 h2 时自动启用
+    "connect_timeout": 5.0,            # 建立连接的超时秒数
+    "read_timeout": 60.0,              # 两次读到数据之间的最长间隔，超时后交给重试/熔断处理
+}
+_clients: Dict[Tuple[str, str], openai.OpenAI] = {}
+_async_clients = weakref.WeakKeyDictionary()  # 事件循环 -> {端点: AsyncOpenAI}，异步连接不能跨事件循环复用
+_lock = threading.Lock()
+
+
+def configure_client_pool(**settings):
+    """更新连接池配置，只影响之后新建的客户端"""
+    unknown = set(settings) - set(_pool_settings)
+    if unknown:
+        raise ValueError(f"未知的连接池配置项: {sorted(unknown)}")
+    with _lock:
+        _pool_settings.update(settings)
+
+
+def _http_options() -> dict:
+    http2 = _pool_settings["http2"]
+    if http2 is None:
+        http2 = importlib.util.find_spec("h2") is not None
+    limits = httpx.Limits(
+        max_connections=_pool_settings["max_connections"],
+        max_keepalive_connections=_pool_settings["max_keepalive_connections"],
+        keepalive_expiry=_pool_settings["keepalive_expiry"],
+    )
+    return {"limits": limits, "http2": http2}
+
+
+def _timeout() -> httpx.Timeout:
+    """请求超时：不设置时 openai 默认等待 600 秒，挂起的端点会长时间占住玩家"""
+    return httpx.Timeout(_pool_settings["read_timeout"], connect=_pool_settings["connect_timeout"])
+
+
+def get_client(api_base: str, api_key: str) -> openai.OpenAI:
+    """获取端点共享的同步客户端（同一个长连接池），需要不同超时/重试时用 with_options 派生"""
+    key = (api_base, api_key)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = openai.OpenAI(
+                base_url=api_base,
+                api_key=api_key,
+                max_retries=0,  # 重试与退避由 resilience 统一处理
+                timeout=_timeout(),
+                http_client=openai.DefaultHttpxClient(**_http_options()),
+            )
+            _clients[key] = client
+        return client
+
+
+def get_async_client(api_base: str, api_key: str) -> openai.AsyncOpenAI:
+    """获取当前事件循环内端点共享的异步客户端，必须在事件循环中调用"""
+    loop = asyncio.get_running_loop()
+    key = (api_base, api_key)
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            client = openai.AsyncOpenAI(
+                base_url=api_base,
+                api_key=api_key,
+                max_retries=0,
+                timeout=_timeout(),
+                http_client=openai.DefaultAsyncHttpxClient(**_http_options()),
+            )
+            clients[key] = client
+        return client
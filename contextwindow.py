@@ -0,0 +1,101 @@
+import re
+from eventlog import Visibility
+from ratelimiter import estimate_tokens
+
+SPEECH_MARKER = re.compile(r"说：|】: ?")  # 发言类消息，折叠时只保留开头
+PHASE_MARKER = "请睁眼"                     # 纯流程提示，折叠时丢弃
+
+
+class ContextWindow:
+    """按 token 预算组装一名玩家的历史对话，分两部分各自限额：
+      - recent：当天的消息原样保留，超出预算时从当天最早的消息开始省略；
+      - summary：之前各天折叠成摘要，超出预算时从最早的一天开始省略。
+        引擎生成了当天的公开摘要（Game.day_summaries）时直接引用，只另外折叠自己可见的私密消息。
+    自己的思考记录（kind="thought"）不进入历史，单次请求的输入长度不随对局天数增长。"""
+
+    BUDGET = {"recent": 3000, "summary": 1500}  # 各部分的token上限
+    FOLD_SPEECH_CHARS = 40  # 折叠后每条发言保留的字数
+    TRIM_RATIO = 0.75       # 当天超出预算时一次裁到预算的这个比例，之后若干次请求的前缀保持不变
+
+    def __init__(self, budget: dict = None):
+        self.budget = {**self.BUDGET, **(budget or {})}
+        self._log = None
+        self._tokens = {}       # {事件序号: token数}
+        self._folded = {}       # {天数: (摘要, token数)}；往日的消息不会再变化，只折叠一次
+        self._recent_start = (None, 0)  # (天数, 当天从第几条消息开始保留)
+
+    def _reset(self, log):
+        """换了一局（新的事件日志）时清空缓存"""
+        self._log = log
+        self._tokens = {}
+        self._folded = {}
+        self._recent_start = (None, 0)
+
+    def _event_tokens(self, event) -> int:
+        tokens = self._tokens.get(event.seq)
+        if tokens is None:
+            tokens = self._tokens[event.seq] = estimate_tokens(event.text) + 1
+        return tokens
+
+    def _fold_event(self, text: str):
+        """往日的一条消息：流程提示丢弃，发言截短，其余（死亡、放逐、查验结果等）原样保留"""
+        if PHASE_MARKER in text:
+            return None
+        match = SPEECH_MARKER.search(text)
+        if match and len(text) - match.end() > self.FOLD_SPEECH_CHARS:
+            return text[:match.end() + self.FOLD_SPEECH_CHARS] + "…"
+        return text
+
+    def _fold_day(self, day: int, events: list, public_summary: str = None):
+        if day not in self._folded:
+            if public_summary is not None:
+                private = [e for e in events if e.visibility != Visibility.ALL]
+                lines = [public_summary] if public_summary else []
+                lines += [line for line in (self._fold_event(e.text) for e in private) if line]
+            else:
+                lines = [line for line in (self._fold_event(e.text) for e in events) if line]
+            header = "### 开局" if day == 0 else f"### 第{day}天（摘要）"
+            text = "\n".join([header] + lines)
+            self._folded[day] = (text, estimate_tokens(text))
+        return self._folded[day]
+
+    def _fit_recent(self, day: int, events: list) -> list:
+        """当天的消息：保留的起点只前进不后退，超出预算时一次多裁一些"""
+        start = self._recent_start[1] if self._recent_start[0] == day else 0
+        start = min(start, len(events))
+        budget = self.budget["recent"]
+        used = sum(self._event_tokens(e) for e in events[start:])
+        if used > budget:
+            while start < len(events) and used > budget * self.TRIM_RATIO:
+                used -= self._event_tokens(events[start])
+                start += 1
+        self._recent_start = (day, start)
+        return events[start:]
+
+    def render(self, chat_log, current_day: int, summaries: dict = None) -> str:
+        """chat_log 为玩家的事件日志视图（PlayerLogView），summaries 为引擎生成的每日公开摘要"""
+        if chat_log.log is not self._log:
+            self._reset(chat_log.log)
+        days = {}
+        for event in chat_log.events():
+            if event.kind != "thought":
+                days.setdefault(event.day, []).append(event)
+        current = days.pop(current_day, [])
+        # 往日摘要从最近的一天往前放，放不下的更早天数整体省略
+        sections, used = [], 0
+        for day in sorted(days, reverse=True):
+            text, tokens = self._fold_day(day, days[day], (summaries or {}).get(day))
+            if used + tokens > self.budget["summary"]:
+                sections.append("（更早的记录已省略）")
+                break
+            sections.append(text)
+            used += tokens
+        sections.reverse()
+        recent = self._fit_recent(current_day, current)
+        if current:
+            lines = [f"### 第{current_day}天"]
+            if len(recent) < len(current):
+                lines.append(f"（当天更早的 {len(current) - len(recent)} 条消息已省略）")
+            lines.extend(e.text for e in recent)
+            sections.append("\n".join(lines))
+        return "\n".join(sections)
@@ -0,0 +1,48 @@
+import re
+
+SPEECH = re.compile(r"玩家 (\d+) 说：(.*)", re.S)
+LAST_WORDS = re.compile(r"【玩家 (\d+)号(.*?) 遗言】: (.*)", re.S)
+CLAIM = re.compile(r"我(?:是|的身份是)(预言家|女巫|猎人|村民|狼人)")
+SEAT = re.compile(r"玩家\s*(\d+)|(\d+)\s*号")
+SENTENCE_END = re.compile(r"[。！？!?；;\n]")
+ACCUSE_WORDS = ("狼", "可疑", "怀疑", "投", "出局", "查杀", "不是好人")
+PHASE_MARKERS = ("请睁眼", "白天讨论时间")  # 纯流程提示，不进入摘要
+
+
+def summarize_speech(speaker: str, body: str) -> str:
+    """把一段发言压缩成「自称的身份 + 怀疑/提及的玩家」"""
+    parts = []
+    claims = list(dict.fromkeys(CLAIM.findall(body)))
+    if claims:
+        parts.append("自称" + "、".join(claims))
+    suspects, mentioned = [], []
+    for sentence in SENTENCE_END.split(body):
+        seats = [a or b for a, b in SEAT.findall(sentence)]
+        target = suspects if any(word in sentence for word in ACCUSE_WORDS) else mentioned
+        for seat in seats:
+            if seat != speaker and seat not in suspects and seat not in mentioned:
+                target.append(seat)
+    if suspects:
+        parts.append("怀疑 " + "、".join(suspects))
+    if mentioned:
+        parts.append("提及 " + "、".join(mentioned))
+    return "；".join(parts) if parts else "未表明立场"
+
+
+def summarize_day(events) -> str:
+    """启发式提取一天的公开事件：死亡、放逐、投票结果原样保留，发言和遗言压缩成立场"""
+    lines = []
+    for event in events:
+        message = event.message
+        if any(marker in message for marker in PHASE_MARKERS):
+            continue
+        match = LAST_WORDS.search(message)
+        if match:
+            lines.append(f"玩家 {match.group(1)}{match.group(2)} 遗言：{summarize_speech(match.group(1), match.group(3))}")
+            continue
+        match = SPEECH.match(message)
+        if match:
+            lines.append(f"玩家 {match.group(1)}：{summarize_speech(match.group(1), match.group(2))}")
+            continue
+        lines.append(message.replace("[系统消息]", "").strip("= "))
+    return "\n".join(lines)
@@ -0,0 +1,106 @@
+import threading
+from typing import List
+
+
+class Visibility:
+    ALL = "all"    # 所有玩家可见
+    ROLE = "role"  # 指定角色可见（如狼人夜间讨论）
+    SEAT = "seat"  # 仅指定座位可见（私密消息、行动前思考）
+
+
+class GameEvent:
+    """对局中的一条事件，只存一份，由各玩家视图按可见性过滤读取"""
+    __slots__ = ("seq", "sender", "message", "day", "phase", "visibility", "target", "kind")
+
+    def __init__(self, seq: int, sender: str, message: str, day: int, phase: str,
+                 visibility: str = Visibility.ALL, target=None, kind: str = "message"):
+        self.seq = seq
+        self.sender = sender          # 发送者，None 表示 message 已是完整文本
+        self.message = message
+        self.day = day
+        self.phase = phase
+        self.visibility = visibility
+        self.target = target          # ROLE 时为角色，SEAT 时为座位号
+        self.kind = kind              # message: 游戏消息；thought: 玩家私有的思考记录
+
+    @property
+    def text(self) -> str:
+        """与原 chatLog 一致的文本格式"""
+        return f"{self.sender}: {self.message}" if self.sender is not None else self.message
+
+    def visible_to(self, player) -> bool:
+        if self.visibility == Visibility.ALL:
+            return True
+        if self.visibility == Visibility.ROLE:
+            return player.role == self.target
+        return player.number == self.target
+
+    def to_dict(self) -> dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class EventLog:
+    """引擎持有的唯一追加式事件日志"""
+
+    def __init__(self):
+        self.events: List[GameEvent] = []
+        self._lock = threading.Lock()
+
+    def append(self, sender: str, message: str, day: int, phase: str,
+               visibility: str = Visibility.ALL, target=None, kind: str = "message") -> GameEvent:
+        with self._lock:
+            event = GameEvent(len(self.events), sender, message, day, phase, visibility, target, kind)
+            self.events.append(event)
+        return event
+
+    def view(self, player) -> "PlayerLogView":
+        return PlayerLogView(self, player)
+
+    def __len__(self):
+        return len(self.events)
+
+
+class PlayerLogView:
+    """玩家的 chatLog 视图：不复制消息，只记录自己可见事件在日志中的位置。
+    支持 chatLog 原有的用法（迭代、len、下标/切片、append）。"""
+
+    def __init__(self, log: EventLog, player):
+        self.log = log
+        self.player = player
+        self._positions: List[int] = []  # 可见事件在 log.events 中的下标
+        self._cursor = 0                 # 已过滤到的日志位置
+
+    def _sync(self):
+        """增量过滤新追加的事件，均摊 O(1)"""
+        events = self.log.events
+        end = len(events)
+        for i in range(self._cursor, end):
+            if events[i].visible_to(self.player):
+                self._positions.append(i)
+        self._cursor = end
+
+    def events(self):
+        """按顺序迭代可见事件对象"""
+        self._sync()
+        events = self.log.events
+        for i in self._positions:
+            yield events[i]
+
+    def append(self, text: str, kind: str = "message") -> GameEvent:
+        """写入只有本座位可见的记录"""
+        game = self.player.game
+        return self.log.append(None, text, game.day, game.state, Visibility.SEAT, self.player.number, kind)
+
+    def __iter__(self):
+        return (event.text for event in self.events())
+
+    def __len__(self):
+        self._sync()
+        return len(self._positions)
+
+    def __getitem__(self, index):
+        self._sync()
+        events = self.log.events
+        if isinstance(index, slice):
+            return [events[i].text for i in self._positions[index]]
+        return events[self._positions[index]].text
@@ -1,52 +1,328 @@
 import json
 import os
 import re
+import threading
 from typing import List, Dict, Tuple
 from collections import defaultdict
 import numpy as np
+from scipy.sparse import csr_matrix, vstack
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
 from Enums import Role, GameState
 
 class ExperiencePool:
-    def __init__(self, experience_dir: str = "./chat_logs"):
+    SNAPSHOT_VERSION = 1  # 快照格式版本，格式变化时递增使旧快照失效
+    
+    def __init__(self, experience_dir: str = "./chat_logs", snapshot_dir: str = None,
+                 refit_every: int = 10):
         self.experience_dir = experience_dir
+        # 索引快照默认放在经验目录下的隐藏子目录中
+        self.snapshot_dir = snapshot_dir or os.path.join(experience_dir, ".experience_index")
         self.experiences = []  # 存储所有经验
         self.vectorizer = TfidfVectorizer(max_features=1000, stop_words=None)
         self.experience_vectors = None
+        # 按 (角色, 经验类型) 预先切好的行块，检索时不再逐条过滤
+        self._partitions = {}
+        # 保护索引整体替换，保证并发读取时经验、向量器和矩阵三者一致
+        self._lock = threading.Lock()
+        # 串行化写入方（增量加入对局、后台重算IDF）
+        self._update_lock = threading.Lock()
+        self._games = {}   # 已索引对局的指纹
+        self._ranges = {}  # 每局经验在 experiences 中的区间
+        self.refit_every = refit_every  # 增量加入多少局后在后台重算IDF
+        self._games_since_refit = 0
+        self._refit_thread = None
+        self._generation = 0  # 索引被整体重建（不是追加）的次数，后台重算据此判断结果是否过期
         self.load_experiences()
     
     def load_experiences(self):
-        """从历史聊天记录中加载经验"""
+        """从历史聊天记录中加载经验（优先复用磁盘快照，只重新解析有变化的对局）"""
         if not os.path.exists(self.experience_dir):
             print("经验池目录不存在，创建空经验池")
             return
         
-        for game_folder in os.listdir(self.experience_dir):
+        fingerprints = self._scan_game_folders()
+        snapshot = self._load_snapshot()
+        if snapshot is not None and snapshot["games"] == fingerprints:
+            # 所有对局都未变化，直接使用快照中的向量器和矩阵
+            experiences, vectorizer, experience_vectors = snapshot["index"]
+            ranges = snapshot["ranges"]
+            if experiences:
+                print(f"从快照加载了 {len(experiences)} 条经验")
+        else:
+            experiences, ranges = self._collect_experiences(fingerprints, snapshot)
+            vectorizer = TfidfVectorizer(max_features=1000, stop_words=None)
+            experience_vectors = None
+            if experiences:
+                # 构建TF-IDF向量
+                contexts = [exp["context"] for exp in experiences]
+                experience_vectors = vectorizer.fit_transform(contexts)
+                print(f"加载了 {len(experiences)} 条经验")
+            self._save_snapshot(fingerprints, ranges, experiences, vectorizer, experience_vectors)
+        
+        with self._update_lock:
+            self._games = fingerprints
+            self._ranges = ranges
+            self._games_since_refit = 0
+            self._generation += 1
+            self._swap_index(experiences, vectorizer, experience_vectors)
+    
+    def _swap_index(self, experiences: List[Dict], vectorizer: TfidfVectorizer, experience_vectors,
+                    partitions: Dict = None):
+        """新索引构建完成后整体替换，读取方不会看到半成品"""
+        if partitions is None:
+            partitions = self._build_partitions(experiences, experience_vectors)
+        with self._lock:
+            self.experiences = experiences
+            self.vectorizer = vectorizer
+            self.experience_vectors = experience_vectors
+            self._partitions = partitions
+    
+    def _build_partitions(self, experiences: List[Dict], experience_vectors,
+                          start: int = 0, base: Dict = None) -> Dict:
+        """按 (角色, 类型) 和 (角色, None) 分组，保存行号和归一化后的子矩阵；
+        传入 base 时只把 start 之后新增的行追加到受影响的分组上"""
+        partitions = dict(base) if base else {}
+        if experience_vectors is None or start >= len(experiences):
+            return partitions
+        
+        grouped = defaultdict(list)
+        for i in range(start, len(experiences)):
+            exp = experiences[i]
+            grouped[(exp["role"], exp["type"])].append(i)
+            grouped[(exp["role"], None)].append(i)
+        
+        for key, rows in grouped.items():
+            rows = np.asarray(rows, dtype=np.int64)
+            # 预先做L2归一化，检索时点积即为余弦相似度
+            block = normalize(experience_vectors[rows], norm="l2", copy=False)
+            if key in partitions:
+                old_rows, old_block = partitions[key]
+                rows = np.concatenate([old_rows, rows])
+                block = vstack([old_block, block], format="csr")
+            partitions[key] = (rows, block)
+        return partitions
+    
+    def add_game(self, game_dir: str) -> int:
+        """加入一局新对局：沿用已拟合的词表，只解析和向量化这局的新经验，不重新拟合整个语料。
+        解析和向量化的开销只与新对局有关；但索引采用写时复制（检索方无锁读取一致的快照），
+        合并经验列表、整体矩阵和受影响的分组子矩阵时会复制一遍已有数据，这部分开销与语料大小成正比。
+        这些都只是内存拷贝（5 万条经验约十几毫秒），而每 refit_every 局一次的后台重算本身就要处理整个语料，
+        因此没有为此改成分块存储"""
+        game_folder = os.path.basename(os.path.normpath(game_dir))
+        if not os.path.isdir(game_dir):
+            return 0
+        fingerprint = self._fingerprint(game_dir)
+        new_experiences = self._extract_game_experiences(game_dir)
+        
+        with self._update_lock:
+            if self._games.get(game_folder) == fingerprint:
+                return 0  # 已经索引过
+            experiences, vectorizer, experience_vectors, partitions = self._current_index()
+            if game_folder in self._ranges:
+                # 已索引对局的内容变了，需要整体重建，交给 refresh 处理
+                print(f"对局 {game_folder} 已在经验池中，如需更新请调用 refresh()")
+                return 0
+            self._games[game_folder] = fingerprint
+            self._ranges[game_folder] = [len(experiences), len(experiences) + len(new_experiences)]
+            if not new_experiences:
+                return 0
+            
+            combined = experiences + new_experiences
+            if experience_vectors is None:
+                # 经验池原本为空，没有可冻结的词表，直接拟合（语料很小）
+                vectorizer = TfidfVectorizer(max_features=1000, stop_words=None)
+                experience_vectors = vectorizer.fit_transform([exp["context"] for exp in combined])
+                partitions = None
+            else:
+                # 冻结词表模式：新词在下次重算IDF前被忽略
+                new_vectors = vectorizer.transform([exp["context"] for exp in new_experiences])
+                experience_vectors = vstack([experience_vectors, new_vectors], format="csr")
+                partitions = self._build_partitions(combined, experience_vectors, len(experiences), partitions)
+            self._swap_index(combined, vectorizer, experience_vectors, partitions)
+            self._games_since_refit += 1
+            need_refit = self._games_since_refit >= self.refit_every
+        
+        print(f"经验池新增 {len(new_experiences)} 条经验（来自 {game_folder}）")
+        if need_refit:
+            self.reweight_idf(background=True)
+        return len(new_experiences)
+    
+    def reweight_idf(self, background: bool = False):
+        """用内存中已解析的经验重新拟合词表和IDF，并刷新磁盘快照"""
+        if not background:
+            self._refit()
+            return
+        with self._update_lock:
+            if self._refit_thread is not None and self._refit_thread.is_alive():
+                return
+            self._refit_thread = threading.Thread(target=self._refit, daemon=True)
+            self._refit_thread.start()
+    
+    def _refit(self):
+        """后台重算：拟合期间不阻塞检索和增量加入，完成后补齐期间新增的经验再替换；
+        拟合期间索引被整体重建（refresh）时结果已对不上，直接丢弃"""
+        with self._update_lock:
+            generation = self._generation
+            experiences = self._current_index()[0]
+        if not experiences:
+            return
+        vectorizer = TfidfVectorizer(max_features=1000, stop_words=None)
+        experience_vectors = vectorizer.fit_transform([exp["context"] for exp in experiences])
+        
+        with self._update_lock:
+            current = self._current_index()[0]
+            if self._generation != generation or len(current) < len(experiences):
+                print("经验池在重算IDF期间被重建，丢弃本次重算结果")
+                return
+            if len(current) > len(experiences):
+                extra = vectorizer.transform([exp["context"] for exp in current[len(experiences):]])
+                experience_vectors = vstack([experience_vectors, extra], format="csr")
+            self._swap_index(current, vectorizer, experience_vectors)
+            self._games_since_refit = 0
+            fingerprints = dict(self._games)
+            ranges = dict(self._ranges)
+        self._save_snapshot(fingerprints, ranges, current, vectorizer, experience_vectors)
+    
+    def _scan_game_folders(self) -> Dict[str, List[int]]:
+        """获取每个对局目录的指纹（最新修改时间和文件数），只做stat不读文件"""
+        fingerprints = {}
+        for game_folder in sorted(os.listdir(self.experience_dir)):
             game_path = os.path.join(self.experience_dir, game_folder)
-            if os.path.isdir(game_path):
-                self._extract_game_experiences(game_path)
+            if game_folder.startswith(".") or not os.path.isdir(game_path):
+                continue
+            fingerprints[game_folder] = self._fingerprint(game_path)
+        return fingerprints
+    
+    def _fingerprint(self, game_path: str) -> List[int]:
+        """单个对局目录的指纹"""
+        latest_mtime = os.stat(game_path).st_mtime_ns
+        file_count = 0
+        for entry in os.scandir(game_path):
+            if entry.is_file():
+                latest_mtime = max(latest_mtime, entry.stat().st_mtime_ns)
+                file_count += 1
+        return [latest_mtime, file_count]
+    
+    def _collect_experiences(self, fingerprints: Dict, snapshot: Dict) -> Tuple[List[Dict], Dict]:
+        """收集所有对局的经验，未变化的对局直接复用快照中的解析结果"""
+        cached_games = snapshot["games"] if snapshot else {}
+        cached_ranges = snapshot["ranges"] if snapshot else {}
+        cached_experiences = snapshot["index"][0] if snapshot else []
         
-        if self.experiences:
-            # 构建TF-IDF向量
-            contexts = [exp["context"] for exp in self.experiences]
-            self.experience_vectors = self.vectorizer.fit_transform(contexts)
-            print(f"加载了 {len(self.experiences)} 条经验")
+        experiences = []
+        ranges = {}
+        for game_folder, fingerprint in fingerprints.items():
+            if cached_games.get(game_folder) == fingerprint and game_folder in cached_ranges:
+                start, end = cached_ranges[game_folder]
+                game_experiences = cached_experiences[start:end]
+            else:
+                game_path = os.path.join(self.experience_dir, game_folder)
+                game_experiences = self._extract_game_experiences(game_path)
+            ranges[game_folder] = [len(experiences), len(experiences) + len(game_experiences)]
+            experiences.extend(game_experiences)
+        return experiences, ranges
+    
+    def _load_snapshot(self):
+        """读取磁盘快照，矩阵以内存映射方式打开；快照缺失或损坏时返回None"""
+        meta_file = os.path.join(self.snapshot_dir, "meta.json")
+        if not os.path.exists(meta_file):
+            return None
+        try:
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get("version") != self.SNAPSHOT_VERSION:
+                return None
+            with open(os.path.join(self.snapshot_dir, "experiences.json"), 'r', encoding='utf-8') as f:
+                experiences = json.load(f)
+            if len(experiences) != meta["shape"][0]:
+                return None
+            
+            vectorizer = TfidfVectorizer(max_features=1000, stop_words=None)
+            experience_vectors = None
+            if experiences:
+                vectorizer.vocabulary_ = meta["vocabulary"]
+                vectorizer.idf_ = np.asarray(meta["idf"], dtype=np.float64)
+                arrays = [
+                    np.load(os.path.join(self.snapshot_dir, f"{name}.npy"), mmap_mode='r')
+                    for name in ("data", "indices", "indptr")
+                ]
+                data, indices, indptr = arrays
+                if len(indptr) != meta["shape"][0] + 1 or indptr[-1] != len(data):
+                    return None
+                experience_vectors = csr_matrix((data, indices, indptr), shape=tuple(meta["shape"]), copy=False)
+            return {
+                "games": meta["games"],
+                "ranges": meta["ranges"],
+                "index": (experiences, vectorizer, experience_vectors),
+            }
+        except (OSError, ValueError, KeyError) as e:
+            print(f"经验池快照读取失败，将重新构建: {e}")
+            return None
+    
+    def _save_snapshot(self, fingerprints: Dict, ranges: Dict, experiences: List[Dict],
+                       vectorizer: TfidfVectorizer, experience_vectors):
+        """保存解析结果、词表/IDF和CSR矩阵，meta.json最后写入作为提交标记"""
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            meta = {
+                "version": self.SNAPSHOT_VERSION,
+                "games": fingerprints,
+                "ranges": ranges,
+                "shape": [len(experiences), 0],
+                "vocabulary": {},
+                "idf": [],
+            }
+            if experience_vectors is not None:
+                matrix = experience_vectors.tocsr()
+                for name in ("data", "indices", "indptr"):
+                    self._atomic_write(f"{name}.npy", lambda f, a=getattr(matrix, name): np.save(f, a), binary=True)
+                meta["shape"] = list(matrix.shape)
+                meta["vocabulary"] = {term: int(i) for term, i in vectorizer.vocabulary_.items()}
+                meta["idf"] = vectorizer.idf_.tolist()
+            self._atomic_write("experiences.json", lambda f: json.dump(experiences, f, ensure_ascii=False))
+            self._atomic_write("meta.json", lambda f: json.dump(meta, f, ensure_ascii=False))
+        except OSError as e:
+            print(f"经验池快照保存失败: {e}")
+    
+    def _atomic_write(self, filename: str, writer, binary: bool = False):
+        """先写临时文件再替换，避免读到写了一半的快照"""
+        path = os.path.join(self.snapshot_dir, filename)
+        tmp_path = path + ".tmp"
+        if binary:
+            with open(tmp_path, 'wb') as f:
+                writer(f)
+        else:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                writer(f)
+        os.replace(tmp_path, path)
+    
+    def refresh(self):
+        """重新扫描经验目录并重建索引（有新对局写入时调用）"""
+        self.load_experiences()
+        return self
+    
+    def _current_index(self):
+        """获取当前索引的一致快照"""
+        with self._lock:
+            return self.experiences, self.vectorizer, self.experience_vectors, self._partitions
     
-    def _extract_game_experiences(self, game_path: str):
+    def _extract_game_experiences(self, game_path: str) -> List[Dict]:
         """从单局游戏中提取经验"""
         # 读取游戏总结
         summary_file = os.path.join(game_path, "game_summary.txt")
         if not os.path.exists(summary_file):
-            return
+            return []
         
         game_info = self._parse_game_summary(summary_file)
         
         # 读取每个玩家的聊天记录
-        for filename in os.listdir(game_path):
+        experiences = []
+        for filename in sorted(os.listdir(game_path)):
             if filename.startswith("player_") and filename.endswith(".txt"):
                 player_file = os.path.join(game_path, filename)
-                self._extract_player_experiences(player_file, game_info)
+                experiences.extend(self._extract_player_experiences(player_file, game_info))
+        return experiences
     
     def _parse_game_summary(self, summary_file: str) -> Dict:
         """解析游戏总结文件"""
@@ -78,7 +354,7 @@ class ExperiencePool:
         
         return game_info
     
-    def _extract_player_experiences(self, player_file: str, game_info: Dict):
+    def _extract_player_experiences(self, player_file: str, game_info: Dict) -> List[Dict]:
         """从玩家聊天记录中提取经验"""
         with open(player_file, 'r', encoding='utf-8') as f:
             content = f.read()
@@ -97,16 +373,19 @@ class ExperiencePool:
                 player_role = line.split("角色:")[-1].strip()
         
         if not player_num or not player_role:
-            return
+            return []
         
         # 提取经验片段
-        self._extract_decision_experiences(lines, player_num, player_role, game_info)
-        self._extract_speech_experiences(lines, player_num, player_role, game_info)
-        self._extract_voting_experiences(lines, player_num, player_role, game_info)
+        return (
+            self._extract_decision_experiences(lines, player_num, player_role, game_info) +
+            self._extract_speech_experiences(lines, player_num, player_role, game_info) +
+            self._extract_voting_experiences(lines, player_num, player_role, game_info)
+        )
     
     def _extract_decision_experiences(self, lines: List[str], player_num: int, 
-                                    player_role: str, game_info: Dict):
+                                    player_role: str, game_info: Dict) -> List[Dict]:
         """提取决策相关经验"""
+        experiences = []
         thinking_pattern = re.compile(r'\[提问与思考\].*?你的行动计划：(.*?)(?=\n|$)')
         
         for i, line in enumerate(lines):
@@ -129,11 +408,13 @@ class ExperiencePool:
                         "day": self._extract_day_from_context(context),
                         "game_phase": self._extract_phase_from_context(context)
                     }
-                    self.experiences.append(experience)
+                    experiences.append(experience)
+        return experiences
     
     def _extract_speech_experiences(self, lines: List[str], player_num: int,
-                                   player_role: str, game_info: Dict):
+                                   player_role: str, game_info: Dict) -> List[Dict]:
         """提取发言相关经验"""
+        experiences = []
         for i, line in enumerate(lines):
             if f"玩家 {player_num} 说：" in line:
                 speech = line.split("说：")[-1].strip()
@@ -150,11 +431,13 @@ class ExperiencePool:
                     "outcome": game_info["winner"],
                     "day": self._extract_day_from_context(context)
                 }
-                self.experiences.append(experience)
+                experiences.append(experience)
+        return experiences
     
     def _extract_voting_experiences(self, lines: List[str], player_num: int,
-                                   player_role: str, game_info: Dict):
+                                   player_role: str, game_info: Dict) -> List[Dict]:
         """提取投票相关经验"""
+        experiences = []
         vote_pattern = re.compile(r'reason.*?vote.*?(\d+)', re.IGNORECASE)
         
         for i, line in enumerate(lines):
@@ -174,7 +457,8 @@ class ExperiencePool:
                     "outcome": game_info["winner"],
                     "day": self._extract_day_from_context(context)
                 }
-                self.experiences.append(experience)
+                experiences.append(experience)
+        return experiences
     
     def _extract_day_from_context(self, context: str) -> int:
         """从上下文中提取游戏天数"""
@@ -192,36 +476,55 @@ class ExperiencePool:
     def retrieve_relevant_experiences(self, current_context: str, role: str, 
                                     experience_type: str = None, top_k: int = 3) -> List[Dict]:
         """检索相关经验"""
-        if not self.experiences or self.experience_vectors is None:
-            return []
-        
-        # 过滤同角色经验
-        filtered_experiences = []
-        for i, exp in enumerate(self.experiences):
-            if exp["role"] == role:
-                if experience_type is None or exp["type"] == experience_type:
-                    filtered_experiences.append((i, exp))
-        
-        if not filtered_experiences:
-            return []
+        return self.retrieve_many([current_context], [role], [experience_type], top_k)[0]
+    
+    def retrieve_many(self, contexts: List[str], roles: List[str],
+                      types: List[str] = None, top_k: int = 3) -> List[List[Dict]]:
+        """批量检索：所有查询一次向量化，同一 (角色, 类型) 分组的查询共用一次稀疏矩阵乘法"""
+        if types is None:
+            types = [None] * len(contexts)
+        results = [[] for _ in contexts]
+        experiences, vectorizer, experience_vectors, partitions = self._current_index()
+        if not contexts or not experiences or experience_vectors is None:
+            return results
         
-        # 计算相似度
-        current_vector = self.vectorizer.transform([current_context])
-        indices = [i for i, _ in filtered_experiences]
-        relevant_vectors = self.experience_vectors[indices]
+        # 行块已归一化，查询向量归一化后点积即余弦相似度
+        query_vectors = normalize(vectorizer.transform(contexts), norm="l2")
         
-        similarities = cosine_similarity(current_vector, relevant_vectors)[0]
+        grouped = defaultdict(list)
+        for i, key in enumerate(zip(roles, types)):
+            grouped[key].append(i)
         
-        # 获取最相似的经验
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
+        for key, query_ids in grouped.items():
+            # 直接取同角色（同类型）的预分组行块
+            partition = partitions.get(key)
+            if partition is None:
+                continue
+            rows, block = partition
+            scores = block.dot(query_vectors[query_ids].T).toarray()  # (行块大小, 查询数)
+            for column, query_id in enumerate(query_ids):
+                results[query_id] = self._top_k(scores[:, column], rows, experiences, top_k)
+        return results
+    
+    def _top_k(self, similarities: np.ndarray, rows: np.ndarray,
+               experiences: List[Dict], top_k: int) -> List[Dict]:
+        """只做部分选择取出 top-k，再对这 k 条排序"""
+        k = min(top_k, len(similarities))
+        if k <= 0:
+            return []
+        if k < len(similarities):
+            top_indices = np.argpartition(-similarities, k - 1)[:k]
+        else:
+            top_indices = np.arange(len(similarities))
+        top_indices = top_indices[np.argsort(-similarities[top_indices])]
         
         relevant_experiences = []
         for idx in top_indices:
             if similarities[idx] > 0.1:  # 相似度阈值
-                exp = filtered_experiences[idx][1]
+                # 复制一份再附加相似度，共享经验池中的条目保持只读
+                exp = dict(experiences[rows[idx]])
                 exp["similarity"] = similarities[idx]
                 relevant_experiences.append(exp)
-        
         return relevant_experiences
     
     def get_advice(self, current_context: str, role: str, action_type: str) -> str:
@@ -229,7 +532,16 @@ class ExperiencePool:
         experiences = self.retrieve_relevant_experiences(
             current_context, role, action_type, top_k=5
         )
-        
+        return self._format_advice(experiences, action_type)
+    
+    def get_advice_many(self, contexts: List[str], roles: List[str], action_types: List[str]) -> List[str]:
+        """批量版 get_advice，供引擎在一个阶段开始时为所有座位预取建议"""
+        batch = self.retrieve_many(contexts, roles, action_types, top_k=5)
+        return [self._format_advice(experiences, action_type)
+                for experiences, action_type in zip(batch, action_types)]
+    
+    def _format_advice(self, experiences: List[Dict], action_type: str) -> str:
+        """把检索到的经验整理成建议文本"""
         if not experiences:
             return "暂无相关经验可参考"
         
@@ -258,4 +570,25 @@ class ExperiencePool:
                 for target, count in common_targets:
                     advice_parts.append(f"- 玩家 {target} 被投票 {count} 次")
         
-        return "\n".join(advice_parts) if advice_parts else "经验数据不足，请谨慎决策"
\ No newline at end of file
+        return "\n".join(advice_parts) if advice_parts else "经验数据不足，请谨慎决策"
+
+
+# 进程级共享经验池：同一目录只加载一次，所有玩家和对局只读共用
+_shared_pools: Dict[str, ExperiencePool] = {}
+_shared_pools_lock = threading.Lock()
+
+
+def get_shared_pool(experience_dir: str = "./chat_logs") -> ExperiencePool:
+    """获取指定目录的共享经验池，首次调用时加载"""
+    key = os.path.abspath(experience_dir)
+    with _shared_pools_lock:
+        pool = _shared_pools.get(key)
+        if pool is None:
+            pool = ExperiencePool(experience_dir)
+            _shared_pools[key] = pool
+        return pool
+
+
+def refresh_shared_pool(experience_dir: str = "./chat_logs") -> ExperiencePool:
+    """重建共享经验池的索引，已持有该经验池的玩家会直接看到新数据"""
+    return get_shared_pool(experience_dir).refresh()
@@ -0,0 +1,110 @@
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Optional
+
+# 对冲请求配置，可通过 config.json 的 "hedging" 覆盖；默认关闭
+_settings = {
+    "enabled": False,
+    "percentile": 95,      # 首字延迟超过该模型最近首字延迟的这个分位数时发出对冲请求
+    "min_samples": 20,     # 样本不足时不对冲
+    "min_delay": 0.5,      # 对冲等待下限（秒），避免延迟很低时频繁重复请求
+}
+
+
+def configure_hedging(**settings):
+    """更新对冲请求配置"""
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise ValueError(f"未知的对冲请求配置项: {sorted(unknown)}")
+    _settings.update(settings)
+
+
+def hedge_delay(router) -> Optional[float]:
+    """等待首字多久后发出对冲请求；未启用或样本不足时返回 None"""
+    if not _settings["enabled"]:
+        return None
+    delay = router.ttft_percentile(_settings["percentile"], _settings["min_samples"])
+    return None if delay is None else max(delay, _settings["min_delay"])
+
+
+def _pick_backup(router, endpoint, tried):
+    """对冲请求优先发往其它端点（其它 key），只有一个端点时发往同一端点"""
+    backup = router.pick(exclude=list(tried) + [endpoint])
+    if backup is None or not backup.circuit_breaker.allow():
+        return None
+    return backup
+
+
+def run_hedged(start, endpoint, router, tried, discard, on_error):
+    """在 endpoint 上执行 start(endpoint)（发起流式请求并等到首个数据块）。
+    首字迟迟不来时向另一个端点再发一份，取先拿到首字的一份，另一份由 discard(端点, 结果) 关闭。
+    返回 (胜出的端点, start 的结果)；全部失败时抛出主请求的异常，其余失败交给 on_error(端点, 异常) 记录。"""
+    delay = hedge_delay(router)
+    if delay is None:
+        return endpoint, start(endpoint)
+    executor = ThreadPoolExecutor(max_workers=2)
+    pending = {executor.submit(start, endpoint): endpoint}
+    try:
+        done, _ = wait(pending, timeout=delay)
+        if not done:
+            backup = _pick_backup(router, endpoint, tried)
+            if backup is not None:
+                print(f"\n{router.model_name} 首字超过 {delay:.2f}s，向 {backup.api_base} 发出对冲请求")
+                pending[executor.submit(start, backup)] = backup
+        primary_error = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                owner = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    if primary_error is not None:
+                        on_error(endpoint, primary_error)
+                    return owner, future.result()
+                if owner is endpoint:
+                    primary_error = error
+                else:
+                    on_error(owner, error)
+        raise primary_error
+    finally:
+        # 同步请求无法中途打断，落选的一份在拿到首字后立即关闭
+        for future, owner in pending.items():
+            future.add_done_callback(
+                lambda f, owner=owner: f.exception() is None and discard(owner, f.result()))
+        executor.shutdown(wait=False)
+
+
+async def run_hedged_async(start, endpoint, router, tried, discard, on_error):
+    """run_hedged 的协程版本：start、discard 为协程函数，落选的请求直接取消"""
+    delay = hedge_delay(router)
+    if delay is None:
+        return endpoint, await start(endpoint)
+    pending = {asyncio.ensure_future(start(endpoint)): endpoint}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            backup = _pick_backup(router, endpoint, tried)
+            if backup is not None:
+                print(f"\n{router.model_name} 首字超过 {delay:.2f}s，向 {backup.api_base} 发出对冲请求")
+                pending[asyncio.ensure_future(start(backup))] = backup
+        primary_error = None
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                owner = pending.pop(task)
+                error = task.exception()
+                if error is None:
+                    if primary_error is not None:
+                        on_error(endpoint, primary_error)
+                    return owner, task.result()
+                if owner is endpoint:
+                    primary_error = error
+                else:
+                    on_error(owner, error)
+        raise primary_error
+    finally:
+        for task, owner in pending.items():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception() is None:
+                await discard(owner, task.result())
@@ -1,17 +1,28 @@
 # main.py
-from collections import Counter
+from collections import Counter, deque
 import random
 import json
 import re
+import itertools
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import List
-import openai
 from Enums import Role, GameState
 from DisplayAdapter import DisplayAdapter
 import json
 import os
 from datetime import datetime
-from experiencepool import ExperiencePool
+from experiencepool import get_shared_pool
+from eventlog import EventLog, Visibility
+from ratelimiter import estimate_tokens
+from contextwindow import ContextWindow
+from daysummary import summarize_day
+from clientpool import configure_client_pool
+from resilience import ENDPOINT, REQUEST, backoff_delay, classify_error, configure_resilience
+from router import get_router, register_endpoint
+from hedging import configure_hedging, run_hedged
+from responsecache import cache_key, configure_response_cache, lookup_response, store_response
 
 
 # LLMPlayerBuilder 用于根据配置文件创建 LLMPlayer 实例
@@ -20,18 +31,58 @@ class LLMPlayerBuilder:
         with open(config_path, 'r') as f:
             self.config = json.load(f)
         self.api_configs = self.config['api_configs']
-    def build_all(self, role: Role):
+        # 所有玩家按端点共享连接池，池大小/HTTP2 可在配置文件中调整
+        configure_client_pool(**self.config.get('client_pool', {}))
+        configure_resilience(**self.config.get('resilience', {}))
+        configure_hedging(**self.config.get('hedging', {}))
+        configure_response_cache(**self.config.get('response_cache', {}))
+        # 先登记全部端点，每个座位的请求会分摊到提供同一模型的所有端点上
+        for config in self.api_configs:
+            register_endpoint(config['model_name'], config['api_base'], config['api_key'],
+                              config.get('rpm'), config.get('tpm'), config.get('structured_output'))
+    def build_all(self, role: Role, player_cls=None):
+        player_cls = player_cls or LLMPlayer  # 异步引擎传入 AsyncLLMPlayer
         players = []
         for config in self.api_configs:
-            player = LLMPlayer(
+            player = player_cls(
                 role=role,
                 api_base=config['api_base'],
                 model_name=config['model_name'],
-                api_key=config['api_key']
+                api_key=config['api_key'],
+                rpm=config.get('rpm'),
+                tpm=config.get('tpm'),
+                # 各行动的输出上限：顶层 max_tokens 为默认值，单个配置项可覆盖
+                max_tokens={**self.config.get('max_tokens', {}), **config.get('max_tokens', {})},
+                fused_actions=config.get('fused_actions', self.config.get('fused_actions', False)),
+                # 历史对话各部分的token预算，与 max_tokens 一样可按模型覆盖
+                context_budget={**self.config.get('context_budget', {}), **config.get('context_budget', {})}
             )
             players.append(player)
         return players
 
+class LLMCall:
+    """一次模型调用在各次重试之间共享的状态"""
+
+    def __init__(self, messages: list, key: str, action: str, response_format: dict = None):
+        self.messages = messages
+        self.key = key  # 回复缓存的键
+        self.action = action
+        self.response_format = response_format
+        self.prompt_tokens = estimate_tokens("".join(m["content"] for m in messages))
+        self.tried = []    # 失败过的端点
+        self.error = None  # 上一次失败的错误，用于计算退避时间
+
+
+class StreamReply:
+    """流式响应累积的内容"""
+
+    def __init__(self, live_print: bool = False):
+        self.content = ""    # 回答内容
+        self.reasoning = ""  # 思维链内容
+        self.live_print = live_print  # 是否逐字打印回答
+        self.usage_reported = False   # 服务端是否返回了用量（只在读完的流末尾返回）
+
+
 class Player:  # 玩家基类
     def __init__(self, role: Role):
         # 将所有属性都作为实例变量初始化，避免多个玩家共享同一状态
@@ -41,10 +92,11 @@ class Player:  # 玩家基类
         self.protected = False # 是否被守卫保护
         self.avatar = "./assets/default.png"
         self.display = None
-        self.chatLog = []  # 每个玩家独有的聊天记录
+        self.chatLog = []  # 聊天记录；加入对局后替换为共享事件日志上的只读视图
         self.SavePotion = 1 # 女巫是否有解药
         self.KillPotion = 1 # 女巫是否有毒药
         self.dataCache = {}
+        self.rng = random.Random()  # 玩家自己的随机源；加入对局后由对局种子派生
 
     def requestSpeech(self, prompt) -> str:
         return self.display.input(prompt)
@@ -53,11 +105,15 @@ class Player:  # 玩家基类
         self.display.update(data)
         self.dataCache = data
 
-    def requestVote(self, prompt: str) -> int:
+    def requestVote(self, prompt: str, valid_targets: list = None) -> int:
         return int(self.display.input(prompt))
 
     def updateChat(self, sender: str, message: str):
         self.chatLog.append(f"{sender}: {message}")
+        self.onMessage(self.chatLog[-1])
+
+    def onMessage(self, log: str):
+        """新消息已进入聊天记录后的回调（私聊或引擎广播）"""
         self.updateDisplay(self.dataCache)
 
     def updateSystem(self, message: str):
@@ -65,30 +121,57 @@ class Player:  # 玩家基类
         self.updateDisplay(self.dataCache)
 
 class LLMPlayer(Player):
+    # 重要事件与态度分析使用的关键词
+    EVENT_KEYWORDS = ["死亡", "放逐", "遗言", "查验", "袭击", "毒杀", "解药", "守护", "刀"]
+    IDENTITY_KEYWORDS = ["预言家", "女巫", "狼人", "猎人", " 神职", "村民"]
+    AGGRESSIVE_WORDS = ["肯定是", "一定是", "必须投", "绝对", "我注意到", "可疑", "怀疑"]
+    DEFENSIVE_WORDS = ["不是我", "我觉得", "可能", "也许"]
+    SPEECH_LIMIT = 100  # 发言保留的最大字数
+    # 各行动的输出token上限（推理模型的思维链也计入其中）；act 为思考与行动合并的单次请求
+    MAX_TOKENS = {"think": 2048, "speech": 1024, "vote": 1024, "act": 3072}
+    OPTIONAL_PARAMS = ("response_format", "stream_options")  # 端点不支持时可以去掉的请求参数
+
     def __init__(self, 
                  role: Role,
                  api_base: str,
                  model_name: str,
                  api_key: str,
                  temperature: float = 0.7,
-                 max_retries: int = 3):
+                 max_retries: int = 3,
+                 rpm: int = None,
+                 tpm: int = None,
+                 max_tokens: dict = None,
+                 fused_actions: bool = False,
+                 context_budget: dict = None):
         super().__init__(role)
         self.api_base = api_base
         self.api_key = api_key
-        # 按照你提供的方式初始化OpenAI客户端
-        self.client = openai.OpenAI(
-            base_url=api_base,
-            api_key=api_key
-        )
+        # 端点（共享的客户端、限流器、熔断器）按 (api_base, api_key) 登记，
+        # 请求由路由器分摊到所有提供该模型的端点，某个端点故障时自动换用其它端点
+        register_endpoint(model_name, api_base, api_key, rpm, tpm)
+        self.router = get_router(model_name)
         self.model_name = model_name
         self.temperature = temperature
         self.max_retries = max_retries
+        self.max_tokens = {**self.MAX_TOKENS, **(max_tokens or {})}
+        self.fused_actions = fused_actions  # 思考与发言/投票合并为一次请求
         self.memory = []  # 对话记忆
         self.questions = self._load_questions()# 加载问题库
-        self.important_events = []  # 重要事件记录
-        self.player_analysis = {}   # 玩家分析记录
+        self.important_events = deque(maxlen=10)  # 重要事件记录（只保留最近10个）
+        self.player_analysis = {}   # 玩家分析记录 {编号: {"recent", "aggressive", "defensive"}}
         self.max_context_length = 2000  # 最大上下文长度
-        self.experience_pool = ExperiencePool()
+        self.context_window = ContextWindow(context_budget)  # 按token预算组装历史对话
+        self.experience_pool = get_shared_pool()  # 所有玩家共用同一个经验池
+        self.prefetched_advice = {}  # 引擎批量预取的经验建议 {(上下文, 行动类型): 建议}
+        self.message_count = 0  # 通过 updateChat 收到的消息数，用于判断是否进入了新回合
+        self._turn_key = None   # 当前回合缓存对应的 (消息数, 天数, 阶段)
+        self._turn_cache = {}   # 回合内复用的压缩上下文和经验建议
+        self._system_prompt_key = None  # 系统提示对应的 (对局, 编号, 角色)
+        self._system_prompt = ""
+        # 服务端返回的用量统计，cached_tokens 为命中前缀缓存的提示token数；
+        # unreported 为提前结束或端点不返回用量、因而没有计入这些数字的成功请求数
+        self.usage = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0,
+                      "unreported": 0}
 
     def _load_questions(self):
         """加载问题库"""
@@ -105,9 +188,56 @@ class LLMPlayer(Player):
                 "WITCH": ["你要使用药水吗？"]
             }
 
+    def onMessage(self, log: str):
+        self.message_count += 1
+        self._index_log(log)
+
+    def _append_private_log(self, entry: str):
+        """写入只有自己可见的思考记录，同步更新索引"""
+        self.chatLog.append(entry, kind="thought")
+        self._index_log(entry)
+
+    def _index_log(self, log: str):
+        """增量维护重要事件和玩家态度索引，每条消息只扫描一次"""
+        if any(keyword in log for keyword in self.EVENT_KEYWORDS) or \
+                any(role in log for role in self.IDENTITY_KEYWORDS):
+            self.important_events.append(log)
+        mentioned = {int(n) for n in re.findall(r"玩家 (\d+)", log)}
+        if not mentioned:
+            return
+        aggressive, defensive = self._count_attitude_words(log)
+        for player_num in mentioned:
+            analysis = self.player_analysis.setdefault(player_num, {
+                "recent": deque(maxlen=3), "aggressive": 0, "defensive": 0,
+            })
+            recent = analysis["recent"]
+            if len(recent) == recent.maxlen:
+                # 滑出窗口的消息从计数中扣除
+                old_aggressive, old_defensive = recent[0]
+                analysis["aggressive"] -= old_aggressive
+                analysis["defensive"] -= old_defensive
+            recent.append((aggressive, defensive))
+            analysis["aggressive"] += aggressive
+            analysis["defensive"] += defensive
+
+    def _get_turn_cache(self) -> dict:
+        """获取回合缓存：收到新消息或天数/阶段变化后自动清空"""
+        turn_key = (self.message_count, self.game.day, self.game.state)
+        if turn_key != self._turn_key:
+            self._turn_key = turn_key
+            self._turn_cache = {}
+        return self._turn_cache
+
     def _build_system_prompt(self) -> str:
-        """构建系统提示"""
-        alive_players = [str(p.number) for p in self.game.getAlivePlayers()]
+        """构建系统提示（整局不变，作为服务端可缓存的公共前缀）"""
+        key = (id(self.game), self.number, self.role)
+        if key != self._system_prompt_key:
+            self._system_prompt_key = key
+            self._system_prompt = self._render_system_prompt()
+        return self._system_prompt
+
+    def _render_system_prompt(self) -> str:
+        """构建系统提示：只包含规则、编号和身份，随局势变化的内容放在 _render_state"""
         role_desc = {
             Role.WEREWOLF: "你是狼人，夜晚与你的同伴讨论袭击目标，白天伪装成村民",
             Role.VILLAGER: "你是普通村民，通过观察找出狼人",
@@ -116,12 +246,10 @@ class LLMPlayer(Player):
             Role.GUARD: "你是守卫，每晚可以守护一名玩家",
             Role.HUNTER: "你是猎人，若被放逐或夜间死亡，可以带走一名玩家",
         }
-        base_prompt = f"""## 游戏规则（新的一局）
+        return f"""## 游戏规则（新的一局）
         你正在参与一场全新的狼人杀游戏，每局游戏互相独立，上一局的信息不再适用。
-- 当前存活玩家：{', '.join(alive_players)}
 - 你的角色：{role_desc[self.role]}
 - 你的编号是{self.number}
-- 游戏阶段：{self.game.state}
 - 禁止暴露角色身份，除非你已经公开身份
 - 你收到的内容就是从最近一次角色分配完成开始完整的游戏上下文流程和所有玩家发言记录 游戏刚开始时上下文为空时正常的
 - 不要胡乱编造
@@ -131,6 +259,14 @@ class LLMPlayer(Player):
 - 如果你是预言家，增加查验目标的随机性
 - 好人阵营在白天投票时要更加激进，因为弃票会增加狼人获胜的概率
 """
+
+    def _render_state(self) -> str:
+        """当前局势（存活玩家、阶段、药水），每次请求都可能变化，放在消息最后"""
+        alive_players = [str(p.number) for p in self.game.getAlivePlayers()]
+        state = f"""## 当前状态
+- 第{self.game.day}天
+- 当前存活玩家：{', '.join(alive_players)}
+- 游戏阶段：{self.game.state}"""
         # 女巫专属提示
         if self.role == Role.WITCH:
             potion_status = []
@@ -139,45 +275,35 @@ class LLMPlayer(Player):
             if self.KillPotion == 1:
                 potion_status.append("毒药可用")
             potion_text = " | ".join(potion_status) if potion_status else "无药可用"
-            return f"{base_prompt}\n- 当前药水状态：{potion_text}"
-        return base_prompt
+            state += f"\n- 当前药水状态：{potion_text}"
+        return state
     
     def _extract_important_events(self):
-        """提取重要事件"""
-        important_events = []
-        for log in self.chatLog:
-            # 提取关键信息
-            if any(keyword in log for keyword in [
-                "死亡", "放逐", "遗言", "查验", "袭击", "毒杀", "解药", "守护","刀",
-            ]):
-                important_events.append(log)
-            # 提取身份相关信息
-            elif any(role in log for role in ["预言家", "女巫", "狼人", "猎人"," 神职", "村民"]):
-                important_events.append(log)
-        return important_events[-10:]  # 只保留最近10个重要事件
+        """提取重要事件（由 _index_log 增量维护）"""
+        return list(self.important_events)
     
     def _summarize_player_behaviors(self):
-        """总结玩家行为模式"""
+        """总结玩家行为模式（读取增量维护的最近3条相关消息计数）"""
         player_summaries = {}
         alive_players = [p.number for p in self.game.getAlivePlayers()]
         for player_num in alive_players:
             if player_num == self.number:
                 continue 
-            # 分析该玩家的发言和投票行为
-            player_logs = [log for log in self.chatLog if f"玩家 {player_num}" in log]
-            recent_logs = player_logs[-3:]  # 只看最近3次发言
-            if recent_logs:
-                summary = f"玩家{player_num}最近态度：{self._analyze_player_attitude(recent_logs)}"
-                player_summaries[player_num] = summary
+            analysis = self.player_analysis.get(player_num)
+            if analysis and analysis["recent"]:
+                attitude = self._attitude_from_counts(analysis["aggressive"], analysis["defensive"])
+                player_summaries[player_num] = f"玩家{player_num}最近态度：{attitude}"
         
         return player_summaries
     
-    def _analyze_player_attitude(self, logs):
-        """分析玩家态度（简化版）"""
-        aggressive_words = ["肯定是", "一定是", "必须投", "绝对","我注意到","可疑","怀疑"]
-        defensive_words = ["不是我", "我觉得", "可能", "也许"]
-        aggressive_count = sum(1 for log in logs for word in aggressive_words if word in log)
-        defensive_count = sum(1 for log in logs for word in defensive_words if word in log)
+    def _count_attitude_words(self, log: str):
+        """统计一条消息中的激进词和保守词数量"""
+        aggressive_count = sum(1 for word in self.AGGRESSIVE_WORDS if word in log)
+        defensive_count = sum(1 for word in self.DEFENSIVE_WORDS if word in log)
+        return aggressive_count, defensive_count
+    
+    def _attitude_from_counts(self, aggressive_count: int, defensive_count: int) -> str:
+        """根据激进/保守词计数判断态度"""
         if aggressive_count > defensive_count:
             return "激进"
         elif defensive_count > aggressive_count:
@@ -186,6 +312,13 @@ class LLMPlayer(Player):
             return "中性"
     
     def _get_condensed_context(self) -> str:
+        """获取压缩后的游戏上下文（同一回合内只计算一次，行动前思考写入的内容不会使其失效）"""
+        cache = self._get_turn_cache()
+        if "condensed_context" not in cache:
+            cache["condensed_context"] = self._build_condensed_context()
+        return cache["condensed_context"]
+
+    def _build_condensed_context(self) -> str:
         """获取压缩后的游戏上下文"""
         # 1. 重要事件
         important_events = self._extract_important_events()
@@ -240,16 +373,20 @@ class LLMPlayer(Player):
         if len(available_questions) <= num_questions:
             return available_questions
         else:
-            return random.sample(available_questions, num_questions)
+            return self.rng.sample(available_questions, num_questions)
 
     def _think_before_action(self):
         """在行动前进行思考（增强版，包含经验检索）"""
+        thinking_prompt = self._build_thinking_prompt()
+        thinking_response = self._call_llm(thinking_prompt, is_print=True, action="think")
+        return self._record_thinking(thinking_prompt, thinking_response)
+
+    def _build_thinking_prompt(self) -> str:
+        """构建行动前思考的提示"""
         # 获取当前上下文用于经验检索
         current_context = self._get_condensed_context()
         # 从经验池获取建议
-        experience_advice = self.experience_pool.get_advice(
-            current_context, str(self.role), "decision"
-        )
+        experience_advice = self._get_advice(current_context, "decision")
         questions = self._get_random_questions(2)
         thinking_prompt = f"""## 行动前思考
 在进行投票或发言之前，请先思考以下问题："""
@@ -259,62 +396,260 @@ class LLMPlayer(Player):
         if experience_advice != "暂无相关经验可参考":
             thinking_prompt += f"\n\n## 历史经验参考\n{experience_advice}"
         thinking_prompt += "\n\n请综合考虑上述问题和历史经验，简要回答并说明你的行动计划："
-        thinking_response = self._call_llm(thinking_prompt, is_print=True)
+        return thinking_prompt
+
+    def _record_thinking(self, thinking_prompt: str, thinking_response: str) -> str:
+        """把思考过程写入自己的私有记录"""
         think = thinking_prompt + thinking_response
-        self.chatLog.append(f"[提问与思考] {think}")
+        self._append_private_log(f"[提问与思考] {think}")
         return think
 
+    def _record_fused_thinking(self, thinking_prompt: str, response: str) -> dict:
+        """合并模式：从一次回复中取出思考写入私有记录，格式与分步思考相同（行动计划紧跟在提示之后），返回解析出的 JSON"""
+        data = self._extract_json(response)
+        if data is None:
+            self._record_thinking(thinking_prompt, response)
+            return {}
+        self._record_thinking(thinking_prompt, f"{data.get('plan', '')}\n{data.get('thinking', '')}")
+        return data
+
+
+    def _get_advice(self, current_context: str, action_type: str) -> str:
+        """获取经验建议，上下文未变时直接使用引擎预取或本回合已检索的结果"""
+        cache = self._get_turn_cache()
+        key = ("advice", current_context, action_type)
+        if key not in cache:
+            advice = self.prefetched_advice.get((current_context, action_type))
+            if advice is None:
+                advice = self.experience_pool.get_advice(current_context, str(self.role), action_type)
+            cache[key] = advice
+        return cache[key]
 
     def _get_game_context(self) -> str:
-        """获取聊天记录作为对话上下文"""
-        context = self.chatLog
-        return "\n".join(context)
+        """获取历史对话：不含自己的思考记录，往日折叠成摘要，整体控制在token预算内"""
+        return self.context_window.render(self.chatLog, self.game.day, self.game.day_summaries)
 
-    def _call_llm(self, prompt: str, is_print: bool) -> str:
-        """调用LLM接口（新增流式处理但保持兼容性）"""
-        messages = [
+    def _build_messages(self, prompt: str) -> list:
+        """构建请求消息：整局不变的系统提示在前，只追加的历史对话居中，当前状态和本次任务在最后，
+        同一座位的相邻请求共享尽可能长的前缀，便于服务端前缀缓存"""
+        return [
             {"role": "system", "content": self._build_system_prompt()},
-            {"role": "user", "content": prompt}
+            {"role": "user", "content": f"## 历史对话\n{self._get_game_context()}"},
+            {"role": "user", "content": f"{self._render_state()}\n\n{prompt}"}
         ]
-        for _ in range(self.max_retries):
+
+    def _call_llm(self, prompt: str, is_print: bool, action: str = "think", response_format: dict = None) -> str:
+        """调用LLM接口（新增流式处理但保持兼容性）；response_format 仅在端点支持时使用。
+        缓存、路由、熔断、重试和用量统计都在共用的辅助方法里，与异步版本只有等待的方式不同"""
+        call, cached = self._start_call(prompt, is_print, action, response_format)
+        if cached is not None:
+            return cached
+        for attempt in range(self.max_retries):
+            endpoint, delay = self._next_endpoint(call, attempt)
+            if endpoint is None:
+                break
+            if delay:
+                time.sleep(delay)
+            if not self._admit(call, endpoint):
+                continue
             try:
-                # 初始化内容容器
-                full_content = ""
-                full_reasoning = ""
-                # 创建流式请求
-                stream = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=messages,
-                    temperature=self.temperature,
-                    max_tokens=4098,  # 限制最大输出长度
-                    stream=True  # 启用流式输出
-                )
-                # 实时处理流式响应
-                for chunk in stream:
-                    if not chunk.choices:
-                        continue
-                    delta = chunk.choices[0].delta
-                    # 处理思维链内容
-                    if getattr(delta, 'reasoning_content', None):
-                        full_reasoning += delta.reasoning_content
-                        # if is_print:
-                        #     print(f"\033[90m{delta.reasoning_content}\033[0m", end="", flush=True)  # 灰色显示思维链
-                    # 处理最终回答内容
-                    if getattr(delta, 'content', None):
-                        full_content += delta.content
-                        if is_print:
-                            print(delta.content, end="", flush=True)  # 正常显示回答内容
-                print()  # 输出换行
-                time.sleep(1)
-                return full_content.strip()
+                endpoint.rate_limiter.acquire(call.prompt_tokens)
+                endpoint, opened = run_hedged(self._hedge_starter(endpoint, call), endpoint, self.router,
+                                              call.tried, self._discard_stream, self._record_failure)
+                try:
+                    reply = self._read_stream(opened, is_print, action)
+                finally:
+                    endpoint.end()
+                return self._finish_call(call, endpoint, reply)
             except Exception as e:
-                print(f"\nAPI Error: {str(e)}")
-                print(self.model_name, self.api_base, self.api_key)
-                # 重试前清空已收集内容
-                full_content = ""
-                full_reasoning = ""
+                if not self._call_failed(call, endpoint, e, attempt):
+                    break
         return ""  # 维持失败返回空字符串
 
+    def _start_call(self, prompt: str, is_print: bool, action: str, response_format: dict = None):
+        """准备一次调用，返回 (调用状态, 缓存中的回复)；命中缓存时不再发出请求"""
+        messages = self._build_messages(prompt)
+        call = LLMCall(messages, self._cache_key(messages, action, response_format), action, response_format)
+        cached = lookup_response(call.key)
+        if cached is not None and is_print:
+            print(cached, flush=True)
+        return call, cached
+
+    def _admit(self, call: LLMCall, endpoint) -> bool:
+        """端点熔断器是否放行本次尝试，不放行时记为已尝试"""
+        if endpoint.circuit_breaker.allow():
+            return True
+        call.tried.append(endpoint)
+        return False
+
+    def _finish_call(self, call: LLMCall, endpoint, reply: StreamReply) -> str:
+        """请求成功：按实际输出（含思维链）补记限流用量，记录端点成功并写入回复缓存"""
+        endpoint.rate_limiter.record_usage(estimate_tokens(reply.content + reply.reasoning))
+        endpoint.circuit_breaker.record_success()
+        if not reply.usage_reported:
+            self.usage["unreported"] += 1
+        content = reply.content.strip()
+        store_response(call.key, self.model_name, content)
+        return content
+
+    def _call_failed(self, call: LLMCall, endpoint, error: Exception, attempt: int) -> bool:
+        """处理一次失败的尝试，返回是否继续重试"""
+        print(f"\nAPI Error: {str(error)}")
+        print(self.model_name, endpoint.api_base, endpoint.api_key)
+        if self._option_rejected(endpoint, call.response_format, error):
+            return True
+        if not self._should_retry(endpoint, error, attempt):
+            return False
+        call.tried.append(endpoint)
+        call.error = error
+        return True
+
+    def _cache_key(self, messages: list, action: str, response_format: dict = None) -> str:
+        """回复缓存的键：同一模型、同样的请求内容和采样参数视为同一次请求"""
+        return cache_key(self.model_name, messages, self.temperature, self.max_tokens[action],
+                         None, response_format)
+
+    def _option_rejected(self, endpoint, response_format: dict, error: Exception) -> bool:
+        """端点以参数错误拒绝请求、且错误指明了某个可选参数时，记下它不支持该参数，去掉后重试；
+        没有指明参数的参数错误（如上下文超长、内容过滤）按普通的请求错误处理，不影响之后的请求"""
+        if classify_error(error) != REQUEST:
+            return False
+        sent = [name for name in self._request_options(endpoint, 0, response_format) if name in self.OPTIONAL_PARAMS]
+        named = [name for name in sent if name == getattr(error, "param", None) or name in str(error)]
+        if not named:
+            return False
+        name = named[0]
+        endpoint.unsupported.add(name)
+        print(f"{endpoint.api_base} 不支持 {name}，之后的请求不再附带")
+        return True
+
+    def _request_options(self, endpoint, max_tokens: int, response_format: dict) -> dict:
+        """请求参数：按行动类型限制最大输出长度；端点支持时附带结构化输出约束，并要求在流末尾返回用量"""
+        options = {"max_tokens": max_tokens, "stream_options": {"include_usage": True}}
+        if response_format:
+            options["response_format"] = response_format
+        return {name: value for name, value in options.items() if name not in endpoint.unsupported}
+
+    def _hedge_starter(self, primary, call: LLMCall):
+        """包装发起请求的函数：对冲请求发往其它端点时同样计入该端点的限流额度"""
+        def start(endpoint):
+            if endpoint is not primary:
+                endpoint.rate_limiter.acquire(call.prompt_tokens)
+            return self._open_stream(endpoint, self._stream_request(endpoint, call))
+        return start
+
+    def _stream_request(self, endpoint, call: LLMCall) -> dict:
+        """发往指定端点的流式请求参数"""
+        return dict(model=self.model_name, messages=call.messages, temperature=self.temperature, stream=True,
+                    **self._request_options(endpoint, self.max_tokens[call.action], call.response_format))
+
+    def _open_stream(self, endpoint, request: dict):
+        """在指定端点上发起流式请求并等到首个数据块，返回 (流, 从头开始的数据块迭代器)。
+        请求计入端点在途数，读完或丢弃后需调用 endpoint.end()"""
+        endpoint.begin()
+        try:
+            started = time.monotonic()
+            stream = endpoint.client.chat.completions.create(**request)
+            chunks = iter(stream)
+            first = next(chunks, None)
+        except BaseException:
+            endpoint.end()
+            raise
+        self.router.record_latency(endpoint, time.monotonic() - started)  # 首字延迟，用于路由和对冲
+        return stream, itertools.chain([first] if first is not None else [], chunks)
+
+    def _discard_stream(self, endpoint, opened):
+        """关闭对冲落选的流"""
+        stream, _ = opened
+        if hasattr(stream, "close"):
+            stream.close()
+        endpoint.end()
+
+    def _answer_complete(self, action: str, content: str) -> bool:
+        """回答是否已经足够，之后的输出反正会被丢弃，可以提前结束流"""
+        if action == "speech":
+            # 与 _clean_speech 一致：去掉【】内容后已满字数；未闭合的【之后暂不计入
+            visible = re.sub(r"【.*?】", "", content.strip())
+            return len(visible.split("【", 1)[0]) >= self.SPEECH_LIMIT
+        if action in ("vote", "act"):
+            # 投票和合并模式只读取第一个 JSON 对象
+            return self._extract_json(content) is not None
+        return False
+
+    def _record_usage(self, usage):
+        """累计流末尾返回的用量（提前结束的流没有这部分）"""
+        if not usage:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.usage["requests"] += 1
+        self.usage["prompt_tokens"] += usage.prompt_tokens or 0
+        self.usage["cached_tokens"] += getattr(details, "cached_tokens", None) or 0
+        self.usage["completion_tokens"] += usage.completion_tokens or 0
+
+    def _read_stream(self, opened, is_print: bool, action: str = "think") -> StreamReply:
+        """读取流式响应；回答完整后关闭连接，不再读取剩余输出"""
+        stream, chunks = opened
+        # 并发阶段（工作线程）里不逐字打印，避免多个玩家的输出交错
+        reply = StreamReply(live_print=is_print and threading.current_thread() is threading.main_thread())
+        for chunk in chunks:
+            if self._consume_chunk(reply, chunk, action):
+                if hasattr(stream, "close"):
+                    stream.close()
+                break
+        self._print_reply(reply, is_print)
+        return reply
+
+    def _consume_chunk(self, reply: StreamReply, chunk, action: str) -> bool:
+        """处理一个数据块：累计用量、思维链和回答内容，回答已经完整时返回 True"""
+        usage = getattr(chunk, "usage", None)
+        if usage:
+            self._record_usage(usage)
+            reply.usage_reported = True
+        if not chunk.choices:
+            return False
+        delta = chunk.choices[0].delta
+        # 处理思维链内容
+        if getattr(delta, 'reasoning_content', None):
+            reply.reasoning += delta.reasoning_content
+        # 处理最终回答内容
+        if getattr(delta, 'content', None):
+            reply.content += delta.content
+            if reply.live_print:
+                print(delta.content, end="", flush=True)  # 正常显示回答内容
+            return self._answer_complete(action, reply.content)
+        return False
+
+    @staticmethod
+    def _print_reply(reply: StreamReply, is_print: bool):
+        """逐字打印时补上换行，否则整段输出"""
+        if reply.live_print:
+            print()
+        elif is_print:
+            print(reply.content, flush=True)
+
+    def _next_endpoint(self, call: LLMCall, attempt: int):
+        """选择本次尝试的端点，返回 (端点, 需要先等待的秒数)：换到未失败过的端点时立即重试，否则先退避"""
+        endpoint = self.router.pick(exclude=call.tried)
+        if endpoint is None:
+            print(f"\n{self.model_name} 的端点均已熔断，跳过请求")
+            return None, 0.0
+        return endpoint, backoff_delay(attempt - 1, call.error) if endpoint in call.tried else 0.0
+
+    def _record_failure(self, endpoint, error: Exception) -> str:
+        """按错误类型更新端点熔断器，返回错误类型"""
+        kind = classify_error(error)
+        if kind == REQUEST:
+            endpoint.circuit_breaker.record_success()  # 端点能正常响应，只是这次请求有误
+        else:
+            endpoint.circuit_breaker.record_failure(trip=kind == ENDPOINT)
+        return kind
+
+    def _should_retry(self, endpoint, error: Exception, attempt: int) -> bool:
+        """记录失败并判断是否还要重试：参数错误直接放弃；端点不可用（鉴权类错误）时熔断并换端点；暂时性错误在次数内重试"""
+        if self._record_failure(endpoint, error) == REQUEST:
+            return False
+        return attempt < self.max_retries - 1
+
 #     def requestSpeech(self, prompt: str) -> str:
 #         """生成智能发言"""
 #         thinking = self._think_before_action()
@@ -330,18 +665,46 @@ class LLMPlayer(Player):
 #         return clean_response[:100]
     def requestSpeech(self, prompt: str) -> str:
         """生成智能发言（增强版，包含经验指导）"""
+        if self.fused_actions:
+            thinking_prompt = self._build_thinking_prompt()
+            response = self._call_llm(self._build_speech_prompt(prompt, thinking_prompt, fused=True),
+                                      is_print=False, action="act", response_format=self._speech_schema())
+            return self._finish_fused_speech(thinking_prompt, response)
         thinking = self._think_before_action()
+        response = self._call_llm(self._build_speech_prompt(prompt, thinking), is_print=False, action="speech")
+        return self._clean_speech(response)
+
+    def _finish_fused_speech(self, thinking_prompt: str, response: str) -> str:
+        """记录合并模式回复中的思考，返回清理后的发言；未按格式回复时整段作为发言"""
+        data = self._record_fused_thinking(thinking_prompt, response)
+        speech = data.get("speech")
+        return self._clean_speech(speech if isinstance(speech, str) else response)
+
+    def _speech_schema(self) -> dict:
+        """合并模式发言的 JSON Schema"""
+        return self._json_schema("speech", {
+            "thinking": {"type": "string"},
+            "plan": {"type": "string"},
+            "speech": {"type": "string"},
+        })
+
+    def _build_speech_prompt(self, prompt: str, thinking: str, fused: bool = False) -> str:
+        """构建发言提示；合并模式下 thinking 为待回答的思考问题"""
         current_context = self._get_condensed_context()
-        speech_advice = self.experience_pool.get_advice(
-            current_context, str(self.role), "speech")
-        full_prompt = f"""## 反思{thinking}## 历史对话{self._get_game_context()}## 你的任务{prompt}"""
+        speech_advice = self._get_advice(current_context, "speech")
+        full_prompt = f"""## 反思{thinking}## 你的任务{prompt}"""
         # 添加发言经验指导
         if speech_advice != "暂无相关经验可参考":
             full_prompt += f"\n\n## 发言经验参考\n{speech_advice}"
         full_prompt += "\n\n基于你的思考和经验参考，请用1-2句话进行发言，保持自然口语化，不要使用特殊符号。注意：不要暴露你的思考过程，只说出你想让其他玩家听到的话。"
-        response = self._call_llm(full_prompt, is_print=False)
+        if fused:
+            full_prompt += '\n先回答反思中的问题，再发言，严格按以下格式回复：{"thinking": "对问题的简要回答", "plan": "你的行动计划", "speech": "发言内容"}'
+        return full_prompt
+
+    def _clean_speech(self, response: str) -> str:
+        """清理发言文本"""
         clean_response = re.sub(r"【.*?】", "", response)
-        return clean_response[:100]
+        return clean_response[:self.SPEECH_LIMIT]
         
     # def requestVote(self, prompt: str) -> int:
     #     """智能投票决策"""
@@ -362,23 +725,102 @@ class LLMPlayer(Player):
     #             return int(numbers[-1]) if numbers else -1
     #     except Exception:
     #         return -1
-    def requestVote(self, prompt: str) -> int:
-        """智能投票决策（增强版，包含经验指导）"""
+    def requestVote(self, prompt: str, valid_targets: list = None) -> int:
+        """智能投票决策（增强版，包含经验指导）；给出 valid_targets 时要求模型只在其中选择"""
+        if self.fused_actions:
+            thinking_prompt = self._build_thinking_prompt()
+            full_prompt = self._build_vote_prompt(prompt, thinking_prompt, valid_targets, fused=True)
+            print(self._vote_header())
+            response = self._call_llm(full_prompt, is_print=True, action="act",
+                                      response_format=self._vote_schema(valid_targets, fused=True))
+            self._record_fused_thinking(thinking_prompt, response)
+            return self._parse_vote(response)
         thinking = self._think_before_action()
+        full_prompt = self._build_vote_prompt(prompt, thinking, valid_targets)
+        print(self._vote_header())
+        response = self._call_llm(full_prompt, is_print=True, action="vote",
+                                  response_format=self._vote_schema(valid_targets))
+        return self._parse_vote(response)
+
+    def _vote_header(self) -> str:
+        """投票回复前打印的标题，同步和异步引擎共用"""
+        return f"玩家{self.number}({self.role}):"
+
+    @staticmethod
+    def _json_schema(name: str, properties: dict) -> dict:
+        """构造 response_format 的严格 JSON Schema，所有字段必填"""
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": name,
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": properties,
+                    "required": list(properties),
+                    "additionalProperties": False,
+                },
+            },
+        }
+
+    def _vote_schema(self, valid_targets: list = None, fused: bool = False) -> dict:
+        """投票的 JSON Schema 约束，vote 只能取合法目标；合并模式额外包含思考和行动计划"""
+        if not valid_targets and not fused:
+            return None
+        properties = {
+            "reason": {"type": "string"},
+            "vote": {"type": "integer", "enum": list(valid_targets)} if valid_targets else {"type": "integer"},
+        }
+        if fused:
+            properties = {"thinking": {"type": "string"}, "plan": {"type": "string"}, **properties}
+        return self._json_schema("vote", properties)
+
+    def _build_vote_prompt(self, prompt: str, thinking: str, valid_targets: list = None, fused: bool = False) -> str:
+        """构建投票提示；合并模式下 thinking 为待回答的思考问题"""
         current_context = self._get_condensed_context()
-        vote_advice = self.experience_pool.get_advice(
-            current_context, str(self.role), "vote")
-        full_prompt = f"""## 反思{thinking}## 历史对话{self._get_game_context()}## 投票规则{prompt}"""
+        vote_advice = self._get_advice(current_context, "vote")
+        full_prompt = f"""## 反思{thinking}## 投票规则{prompt}"""
         if vote_advice != "暂无相关经验可参考":
             full_prompt += f"\n\n## 投票经验参考\n{vote_advice}"
-        full_prompt += '\n\n请综合考虑所有信息，严格按以下格式回复：{"reason": "分析原因", "vote": 玩家编号或-1}'
-        print(f"玩家{self.number}({self.role}):")
-        response = self._call_llm(full_prompt, is_print=True)
+        if fused:
+            full_prompt += '\n\n先回答反思中的问题，再综合考虑所有信息投票，严格按以下格式回复：{"thinking": "对问题的简要回答", "plan": "你的行动计划", "reason": "分析原因", "vote": 玩家编号或-1}'
+        else:
+            full_prompt += '\n\n请综合考虑所有信息，严格按以下格式回复：{"reason": "分析原因", "vote": 玩家编号或-1}'
+        if valid_targets:
+            full_prompt += f'\nvote 只能是以下之一：{list(valid_targets)}'
+        return full_prompt
+
+    def _extract_json(self, response: str):
+        """解析回复中的第一个 JSON 对象，没有完整的 JSON 对象时返回 None"""
+        start = response.find("{")
+        if start == -1:
+            return None
+        try:
+            data, _ = json.JSONDecoder().raw_decode(response[start:])
+        except ValueError:
+            try:
+                # 兼容旧格式：只取第一个 { 到其后第一个 } 之间的内容
+                data = json.loads(response[start:response.find("}", start) + 1])
+            except ValueError:
+                return None
+        return data if isinstance(data, dict) else None
+
+    def _extract_vote(self, response: str):
+        """解析回复中第一个 JSON 对象里的 vote，没有完整的 JSON 对象时返回 None"""
+        data = self._extract_json(response)
+        if data is None:
+            return None
+        try:
+            return int(data["vote"])
+        except (KeyError, TypeError, ValueError):
+            return -1
+
+    def _parse_vote(self, response: str) -> int:
+        """从回复中解析投票目标，解析失败返回-1"""
         try:
             if "{" in response:
-                json_part = response[response.find("{"):response.find("}")+1]
-                data = json.loads(json_part)
-                return int(data["vote"])
+                vote = self._extract_vote(response)
+                return vote if vote is not None else -1
             else:
                 numbers = re.findall(r'\d+', response)
                 return int(numbers[-1]) if numbers else -1
@@ -392,13 +834,39 @@ class LLMPlayer(Player):
         #     self.hasKillPotion = data.get("hasKill", True)
         # super().updateDisplay(data)
 
+class Ask:
+    """规则流程向引擎发出的请求：调用 func(*args)（通常是等待玩家发言或投票），结果送回流程"""
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+
+class TaskGraph:
+    """规则流程向引擎发出的请求：按依赖关系执行一组子流程，parallel 为 False 时按声明顺序逐个执行"""
+
+    def __init__(self, tasks: dict, parallel: bool = True):
+        self.tasks = tasks  # {任务名: (函数, 依赖任务名元组)}，函数接收 {依赖名: 结果} 并返回一段规则流程
+        self.parallel = parallel
+
+
 class Game:
-    def __init__(self, players: List[Player]):
+    MAX_VOTE_ATTEMPTS = 2  # AI玩家给出无效投票时最多请求的次数，之后按默认结果处理
+
+    def __init__(self, players: List[Player], concurrent_votes: bool = True, concurrent_night: bool = True,
+                 seed: int = None):
         self.day = 0
+        # 对局的随机种子：角色分配和各玩家的随机源都由它派生，相同种子可以复现同样的对局走向
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.rng = random.Random(self.seed)
+        self.concurrent_votes = concurrent_votes  # 互不可见的投票是否并发收集
+        self.concurrent_night = concurrent_night  # 夜间互不依赖的角色行动是否并发执行
         self.dayLog = []
         self.players = players
         self.state = GameState.NIGHT
         self.night_deaths = []  # 用于保存夜间死亡玩家的编号
+        self.events = EventLog()  # 全局唯一的事件日志，玩家按可见性读取
+        self.day_summaries = {}   # {天数: 当天公开事件的摘要}，每天结束时生成一次，所有座位共用
         total_players = len(players)
         if total_players < 5:
             raise ValueError("游戏需要至少5名玩家")
@@ -419,17 +887,20 @@ class Game:
             special_roles +
             [Role.VILLAGER] * villager_count
         )
-        random.shuffle(roles)
+        self.rng.shuffle(roles)
         # 分配角色和编号
         for i, player in enumerate(players):
             player.number = i + 1
             player.role = roles[i]
+            # 每个玩家单独的随机源，并发行动时抽取顺序不影响结果
+            player.rng = random.Random(self.rng.getrandbits(32))
             player.game = self  # 绑定游戏实例
+            player.chatLog = self.events.view(player)
             player.alive = True  # 重置存活状态
             player.protected = False
             if hasattr(player, 'last_guarded'):
                 player.last_guarded = None  # 重置守卫记忆
-        print("角色分配完成：")
+        print(f"角色分配完成（随机种子 {self.seed}）：")
         for p in players:
             print(f"玩家 {p.number} 号：{p.role}")
 
@@ -437,12 +908,17 @@ class Game:
         """游戏结束后保存每个玩家的聊天记录到txt文件"""
         # 创建logs目录
         logs_dir = "chat_logs"
-        if not os.path.exists(logs_dir):
-            os.makedirs(logs_dir)
-        # 生成时间戳作为文件夹名
+        os.makedirs(logs_dir, exist_ok=True)
+        # 生成时间戳作为文件夹名（同一秒内结束的多局对局追加序号区分）
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        game_dir = os.path.join(logs_dir, f"game_{timestamp}")
-        os.makedirs(game_dir)
+        suffix = 0
+        while True:
+            game_dir = os.path.join(logs_dir, f"game_{timestamp}" + (f"_{suffix}" if suffix else ""))
+            try:
+                os.makedirs(game_dir)
+                break
+            except FileExistsError:
+                suffix += 1
         # 为每个玩家保存聊天记录
         for player in self.players:
             filename = f"player_{player.number}_{player.role}.txt"
@@ -464,6 +940,7 @@ class Game:
             f.write(f"狼人杀游戏总结 - {timestamp}\n")
             f.write("=" * 50 + "\n")
             f.write(f"游戏天数: {self.day}\n")
+            f.write(f"随机种子: {self.seed}\n")
             f.write(f"最终状态: {self.state}\n\n")
             # 角色分配
             f.write("角色分配:\n")
@@ -477,12 +954,46 @@ class Game:
                 f.write("游戏结果: 村民阵营胜利\n")
             else:
                 f.write("游戏结果: 狼人阵营胜利\n")
+            usage_lines = self._usage_summary()
+            if usage_lines:
+                f.write("\n用量统计（服务端返回）:\n" + "\n".join(usage_lines) + "\n")
         print(f"\n聊天记录已保存到: {game_dir}")
+        if usage_lines:
+            print(usage_lines[-1].strip())
+        # 把本局经验增量加入玩家正在使用的经验池，后续对局无需重启即可参考
+        pools = {id(p.experience_pool): p.experience_pool for p in self.players if hasattr(p, "experience_pool")}
+        for pool in pools.values():
+            pool.add_game(game_dir)
         return game_dir
 
 
+    def _usage_summary(self) -> list:
+        """各AI玩家的提示token数和前缀缓存命中率，最后一行为合计。
+        用量只在读完的流末尾返回，提前结束的请求不计入命中率，单独列出次数"""
+        lines = []
+        total_requests = total_prompt = total_cached = total_unreported = 0
+        for player in self.players:
+            usage = getattr(player, "usage", None)
+            if not usage or not (usage["prompt_tokens"] or usage["unreported"]):
+                continue
+            total_requests += usage["requests"]
+            total_prompt += usage["prompt_tokens"]
+            total_cached += usage["cached_tokens"]
+            total_unreported += usage["unreported"]
+            ratio = f"{usage['cached_tokens'] / usage['prompt_tokens']:.1%}" if usage["prompt_tokens"] else "无数据"
+            lines.append(f"  玩家 {player.number} 号 返回用量的请求 {usage['requests']} 次，提示 {usage['prompt_tokens']} token，"
+                         f"缓存命中 {usage['cached_tokens']} token（{ratio}），未返回用量 {usage['unreported']} 次")
+        if lines:
+            ratio = f"{total_cached / total_prompt:.1%}" if total_prompt else "无数据"
+            lines.append(f"  前缀缓存命中率（仅统计返回了用量的 {total_requests} 次请求，"
+                         f"另有 {total_unreported} 次提前结束或未返回用量）: {ratio}（{total_cached}/{total_prompt} token）")
+        return lines
+
     def checkWin(self) -> bool:
         """检查游戏是否结束"""
+        return self._run_steps(self._check_win())
+
+    def _check_win(self):
         alive_players = self.getAlivePlayers()
         werewolves = [p for p in alive_players if p.role == Role.WEREWOLF]
         villagers = [p for p in alive_players if p.role not in (Role.WEREWOLF, Role.SEER, Role.WITCH, Role.GUARD, Role.HUNTER)]
@@ -491,13 +1002,13 @@ class Game:
             self._broadcast("村民阵营胜利！")
             # self.updateDisplay()
             # 游戏结束时保存聊天记录
-            self.save_chat_logs()
+            yield Ask(self.save_chat_logs)
             return True
         if not villagers or not special_roles:
             self._broadcast("狼人阵营胜利！")
             # self.updateDisplay()
             # 游戏结束时保存聊天记录
-            self.save_chat_logs()
+            yield Ask(self.save_chat_logs)
             return True
         return False
 
@@ -550,6 +1061,12 @@ class Game:
     #         }
     #         player.updateDisplay(data)
 
+    def _summarize_day(self):
+        """当天结束时把公开事件压缩成摘要，之后各座位的历史对话直接引用，不再重复发送原文"""
+        events = [e for e in self.events.events
+                  if e.day == self.day and e.visibility == Visibility.ALL and e.kind == "message"]
+        self.day_summaries[self.day] = summarize_day(events)
+
     def _broadcast(self, message: str, role_filter=None):
         """
         广播消息给所有玩家或指定角色：
@@ -558,11 +1075,68 @@ class Game:
         """
         recipients = self.players if role_filter is None else [p for p in self.players if p.role == role_filter]
         print(message)  # 控制台输出
+        # 消息只在事件日志中存一份，接收者通过各自的视图看到它
+        if role_filter is None:
+            event = self.events.append("System", message, self.day, self.state)
+        else:
+            event = self.events.append("System", message, self.day, self.state, Visibility.ROLE, role_filter)
         for p in recipients:
-            p.updateSystem(message)
+            p.onMessage(event.text)
+
+    def _prefetch_advice(self, players, action_types):
+        """为一个阶段内的所有AI座位批量预取经验建议（每个经验池一次向量化调用）"""
+        by_pool = {}
+        for p in players:
+            if isinstance(p, LLMPlayer):
+                by_pool.setdefault(id(p.experience_pool), (p.experience_pool, []))[1].append(p)
+        for pool, pool_players in by_pool.values():
+            queries = [(p, p._get_condensed_context(), action_type)
+                       for p in pool_players for action_type in action_types]
+            advice = pool.get_advice_many(
+                [context for _, context, _ in queries],
+                [str(p.role) for p, _, _ in queries],
+                [action_type for _, _, action_type in queries],
+            )
+            for p in pool_players:
+                p.prefetched_advice = {}
+            for (p, context, action_type), text in zip(queries, advice):
+                p.prefetched_advice[(context, action_type)] = text
+
+    def _vote_choices(self, valid_targets, allow_abstain=True) -> list:
+        """玩家可以给出的全部投票结果"""
+        return list(valid_targets) + ([-1] if allow_abstain and -1 not in valid_targets else [])
+
+    def _vote_exhausted(self, player, attempts: int, valid_targets, allow_abstain=True):
+        """AI玩家无效投票次数用尽时返回确定的默认结果（能弃权则弃权，否则取第一个合法目标），否则返回 None"""
+        if not isinstance(player, LLMPlayer) or attempts < self.MAX_VOTE_ATTEMPTS:
+            return None
+        fallback = -1 if allow_abstain or not valid_targets else valid_targets[0]
+        print(f"玩家{player.number} 连续 {attempts} 次无效投票，按 {fallback} 处理")
+        return fallback
+
+    def _run_steps(self, steps):
+        """执行一段规则流程：流程产生的请求（Ask/TaskGraph）在这里完成后把结果送回流程，
+        请求抛出的异常也交回流程处理。异步引擎用同样的流程，只替换执行请求的方式"""
+        send, value = steps.send, None
+        while True:
+            try:
+                request = send(value)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                value, send = self._perform(request), steps.send
+            except Exception as e:
+                value, send = e, steps.throw
+
+    def _perform(self, request):
+        if isinstance(request, TaskGraph):
+            return self._run_task_graph(request.tasks, request.parallel)
+        return request.func(*request.args)
 
     def _safe_vote(self, player, prompt, valid_targets, allow_abstain=True):
         """安全的投票请求，确保投票结果在允许范围内"""
+        choices = self._vote_choices(valid_targets, allow_abstain)
+        attempts = 0
         while True:
             try:
                 # if player.role == Role.WITCH:
@@ -570,12 +1144,75 @@ class Game:
                 #     vote = player.witch_requestVote(prompt)
                 # else:
                 #     vote = player.requestVote(prompt)
-                vote = player.requestVote(prompt)
-                if vote in valid_targets or (allow_abstain and vote == -1):
+                vote = yield Ask(player.requestVote, prompt, choices)
+                if vote in choices:
                     return vote
                 player.updateSystem(f"无效目标，请选择：{valid_targets}")
             except ValueError:
                 player.updateSystem("请输入有效数字")
+            attempts += 1
+            fallback = self._vote_exhausted(player, attempts, valid_targets, allow_abstain)
+            if fallback is not None:
+                return fallback
+
+    def _collect_votes(self, voters, prompt, valid_targets, allow_abstain=True):
+        """收集一组互相独立的投票：全部是AI玩家时并发发起请求，结果按投票者顺序返回"""
+        if not voters:
+            return {}
+        tasks = {v.number: (lambda deps, v=v: self._safe_vote(v, prompt, valid_targets, allow_abstain), ())
+                 for v in voters}
+        # 真人玩家需要终端输入，保持逐个询问
+        parallel = self.concurrent_votes and all(isinstance(v, LLMPlayer) for v in voters)
+        return (yield TaskGraph(tasks, parallel))
+
+    def _run_task_graph(self, tasks, parallel=True):
+        """按依赖关系执行一组任务，依赖都已完成的任务并发执行。
+        tasks: {任务名: (函数, 依赖任务名元组)}，函数接收 {依赖名: 结果} 并返回一段规则流程；
+        返回 {任务名: 流程结果}，按声明顺序排列"""
+        results = {}
+        if not parallel:
+            # 串行时按声明顺序在当前线程逐个执行（即原有的执行顺序）
+            for name, (func, deps) in tasks.items():
+                if not all(dep in results for dep in deps):
+                    raise ValueError(f"任务依赖无法满足：{name}")
+                results[name] = self._run_steps(func({dep: results[dep] for dep in deps}))
+            return results
+        pending = dict(tasks)
+        running = {}
+        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            while pending or running:
+                for name, (func, deps) in list(pending.items()):
+                    if all(dep in results for dep in deps):
+                        steps = func({dep: results[dep] for dep in deps})
+                        running[executor.submit(self._run_steps, steps)] = name
+                        del pending[name]
+                if not running:
+                    raise ValueError(f"任务依赖无法满足：{list(pending)}")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        return {name: results[name] for name in tasks}
+
+    def _night_phase(self):
+        """夜间行动依赖图：预言家查验（以及将来的守卫）与狼人讨论/投票互不依赖可并发；
+        女巫需要知道袭击目标，并且她的行动会修改存活名单（预言家的提示由它生成，不能提前看到当晚的死亡），
+        所以等狼人和预言家都完成后再行动"""
+        night_tasks = {
+            "seer": (lambda deps: self._seer_action(), ()),
+            # "guard": (lambda deps: self._guard_action(), ()),
+            "werewolf": (lambda deps: self._werewolf_action(), ()),
+            "witch": (lambda deps: self._resolve_attack(deps["werewolf"]), ("werewolf", "seer")),
+        }
+        # 真人玩家需要终端输入，保持串行
+        parallel = self.concurrent_night and all(isinstance(p, LLMPlayer) for p in self.players)
+        yield TaskGraph(night_tasks, parallel)
+
+    def _resolve_attack(self, attack_target):
+        """根据狼人袭击目标执行女巫行动"""
+        if attack_target is None:
+            print("没有狼人行动，跳过女巫行动")
+        else: 
+            yield from self._witch_action(attack_target)
 
     def _resolve_votes(self, votes, action_name, is_public=False):
         """通用投票决议逻辑"""
@@ -603,7 +1240,7 @@ class Game:
         hunters = self.getHunters()
         for hunter in hunters:
             self._broadcast(f"[系统消息]=== 猎人 {hunter.number} 请睁眼 ===", role_filter=Role.HUNTER)
-            target = self._safe_vote(
+            target = yield from self._safe_vote(
                 hunter,
                 "你必须要选择带走一名玩家（输入玩家编号）",
                 valid_targets=[p.number for p in self.getAlivePlayers()],
@@ -616,7 +1253,6 @@ class Game:
 
     def _werewolf_action(self):
         # self.updateDisplay()
-        votes = {}
         candidates = [p.number for p in self.getAlivePlayers() if p.role != Role.WEREWOLF]
         
         # 狼人内部讨论（仅向狼人广播）
@@ -624,26 +1260,24 @@ class Game:
         for wolf in self.getAliveWerewolves():
             teammates = [str(p.number) for p in self.getAliveWerewolves() if p != wolf]
             wolf.updateSystem(f"[狼人队友信息] 你的队友是：{', '.join(teammates) if teammates else '只有你一人'}")
-            speech = wolf.requestSpeech("狼人队伍讨论(仅队友可见) 请发言:")
+            speech = yield Ask(wolf.requestSpeech, "狼人队伍讨论(仅队友可见) 请发言:")
             self._broadcast(f"🐺【狼人 {wolf.number}号】: {speech}", role_filter=Role.WEREWOLF)
         
-        # 狼人投票
-        for wolf in self.getAliveWerewolves():
-            # self.updateDisplay()
-            vote = self._safe_vote(
-                wolf,
-                f"请选择袭击目标（存活玩家：{candidates}）,注意：狼人不能弃票，不能平票",
-                valid_targets=candidates,
-                allow_abstain=False
-            )
-            votes[wolf.number] = vote
+        # 狼人投票（投票期间彼此看不到对方的票，上下文不变，可以批量预取建议）
+        yield Ask(self._prefetch_advice, self.getAliveWerewolves(), ["decision", "vote"])
+        votes = yield from self._collect_votes(
+            self.getAliveWerewolves(),
+            f"请选择袭击目标（存活玩家：{candidates}）,注意：狼人不能弃票，不能平票",
+            valid_targets=candidates,
+            allow_abstain=False
+        )
         return self._resolve_votes(votes, "袭击")
     
     def _execute_player(self, number):
         player = self.getPlayer(number)
         player.alive = False
         self._broadcast(f"[系统消息]=== 玩家 {number}号 被放逐 ===")
-        last_words = player.requestSpeech("请发表遗言")
+        last_words = yield Ask(player.requestSpeech, "请发表遗言")
         role_reveal = f"({player.role})" if hasattr(player, 'role') else ""
         self._broadcast(f"[系统消息]【玩家 {number}号{role_reveal} 遗言】: {last_words}")
 
@@ -664,7 +1298,7 @@ class Game:
         self._broadcast(witch_msg, role_filter=Role.WITCH)
         attack_saved = False
         if witch.SavePotion == 1:
-            if self._safe_vote(witch, "女巫是否使用解药？（1: 是，0: 否）", [0, 1]) == 1:
+            if (yield from self._safe_vote(witch, "女巫是否使用解药？（1: 是，0: 否）", [0, 1])) == 1:
                 target_player.alive = True
                 witch.SavePotion = 0
                 save_msg = f"[系统消息]女巫使用了解药拯救玩家 {attack_target}号"
@@ -679,7 +1313,7 @@ class Game:
         # 女巫毒药行动
         if witch.KillPotion == 1:
             valid_targets = [p.number for p in self.getAlivePlayers()] + [-1]
-            target = self._safe_vote(
+            target = yield from self._safe_vote(
                 witch,
                 "请选择要毒杀的玩家（-1 表示不使用）",
                 valid_targets=valid_targets,
@@ -701,7 +1335,7 @@ class Game:
             print("没有存活的预言家，跳过预言家行动")
             return
         self._broadcast("[系统消息]=== 预言家请睁眼 ===", role_filter=Role.SEER)
-        target = self._safe_vote(
+        target = yield from self._safe_vote(
             seer,
             "请选择要查验的玩家",
             valid_targets=[p.number for p in self.getAlivePlayers()],
@@ -721,36 +1355,32 @@ class Game:
         self._broadcast(f"[系统消息]第 {self.day} 天开始，白天讨论时间")
         for player in self.getAlivePlayers():
             # self.updateDisplay()
-            speech = player.requestSpeech("请发表你的看法")
+            speech = yield Ask(player.requestSpeech, "请发表你的看法")
             self._broadcast(f"玩家 {player.number} 说：{speech}")
 
     def _daytime_voting(self):
-        votes = {}
         candidates = [p.number for p in self.getAlivePlayers()]
         # self.updateDisplay()
-        for voter in self.getAlivePlayers():
-            vote = self._safe_vote(
-                voter,
-                f"请选择要放逐的玩家（存活玩家：{candidates}）",
-                valid_targets=candidates + [-1],
-                allow_abstain=True
-            )
-            votes[voter.number] = vote
+        yield Ask(self._prefetch_advice, self.getAlivePlayers(), ["decision", "vote"])
+        votes = yield from self._collect_votes(
+            self.getAlivePlayers(),
+            f"请选择要放逐的玩家（存活玩家：{candidates}）",
+            valid_targets=candidates + [-1],
+            allow_abstain=True
+        )
         return self._resolve_votes(votes, "放逐", is_public=True)
 
-    def updateDay(self):
+    def updateDay(self) -> bool:
+        """进行一天（夜晚和白天），游戏结束时返回 True"""
+        return self._run_steps(self._play_day())
+
+    def _play_day(self):
         self.day += 1
         # 夜晚阶段
         self.state = GameState.NIGHT
         # 重置夜间死亡记录
         self.night_deaths = []
-        # self._guard_action()
-        self._seer_action()
-        attack_target = self._werewolf_action()
-        if attack_target is None:
-            print("没有狼人行动，跳过女巫行动")
-        else: 
-            self._witch_action(attack_target)
+        yield from self._night_phase()
         # 白天阶段
         self.state = GameState.DAY
         # 天亮时公布夜间死亡信息
@@ -761,23 +1391,24 @@ class Game:
                 player = self.getPlayer(dead_player_id)
                 if player.role == Role.HUNTER:
                     self._broadcast(f"[系统消息]猎人 {dead_player_id} 昨晚死亡，触发猎人技能")
-                    self._hunter_action()
+                    yield from self._hunter_action()
         else:
             self._broadcast("[系统消息]昨晚无人死亡")
         # 清空夜间记录，防止影响下一晚
         self.night_deaths = []
-        self._daytime_discussion()
-        eliminated = self._daytime_voting()
+        yield from self._daytime_discussion()
+        eliminated = yield from self._daytime_voting()
         if eliminated:
-            self._execute_player(eliminated)
+            yield from self._execute_player(eliminated)
             if self.getPlayer(eliminated).role == Role.HUNTER:
                 self._broadcast(f"[系统消息]猎人 {eliminated} 被放逐，进行猎人行动")
                 # 猎人行动
-                self._hunter_action()
+                yield from self._hunter_action()
         else:
             self._broadcast("[系统消息]今日无人被放逐")
+        self._summarize_day()
         # self.updateDisplay()
-        return self.checkWin()
+        return (yield from self._check_win())
 
     def main(self):
         for player in self.players:
@@ -797,11 +1428,12 @@ class Game:
             raise
 
 # 示例用法：仅一个真人玩家，其余均为 AI 玩家
-builder = LLMPlayerBuilder('config.json')  # 创建 LLMPlayerBuilder 实例
-players = [
-    *builder.build_all(None),  # 使用 builder 创建所有 AI 玩家
-    # Player(None)  # 由真人控制的玩家
-]
-
-game = Game(players)
-game.main()
\ No newline at end of file
+if __name__ == "__main__":
+    builder = LLMPlayerBuilder('config.json')  # 创建 LLMPlayerBuilder 实例
+    players = [
+        *builder.build_all(None),  # 使用 builder 创建所有 AI 玩家
+        # Player(None)  # 由真人控制的玩家
+    ]
+
+    game = Game(players, seed=builder.config.get('seed'))  # 配置文件中可选的 seed 用于复现对局
+    game.main()
\ No newline at end of file
@@ -0,0 +1,373 @@
+# mockserver.py
+# 本地模拟的 OpenAI 兼容服务：流式 chat completions + /v1/models，
+# 可配置首字延迟、生成速度和错误率（429/5xx/超时），按身份给出脚本化回复，用于离线压测并发、重试和限流。
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 模拟服务配置，可通过命令行参数或 start_mock_server(**settings) 覆盖
+_settings = {
+    "host": "127.0.0.1",
+    "port": 8000,
+    "models": ["mock-model"],   # /v1/models 返回的模型；请求其它模型时返回 404
+    "api_key": None,            # 设置后校验 Authorization，不匹配时返回 401
+    "ttft": 0.3,                # 首字延迟（秒）
+    "ttft_jitter": 0.1,         # 首字延迟的随机浮动（秒）
+    "tokens_per_second": 50.0,  # 生成速度
+    "reasoning_tokens": 0,      # 正式回答前先输出多少个思维链 token（reasoning_content）
+    "rate_limit_rate": 0.0,     # 返回 429 的概率
+    "retry_after": 1.0,         # 429 附带的 Retry-After（秒）
+    "server_error_rate": 0.0,   # 返回 500/502/503 的概率
+    "timeout_rate": 0.0,        # 不返回任何数据、挂起 hang_seconds 后断开的概率
+    "hang_seconds": 60.0,
+    "structured_output": True,  # False 时带 response_format 的请求返回 400
+    "seed": None,               # 错误注入的随机种子
+}
+
+ROLE_MARKERS = {  # 系统提示中的身份描述
+    "werewolf": "你是狼人",
+    "seer": "你是预言家",
+    "witch": "你是女巫",
+    "hunter": "你是猎人",
+    "guard": "你是守卫",
+    "villager": "你是普通村民",
+}
+SPEECHES = {
+    "werewolf": "我是村民，感觉玩家 {t} 的发言有些站不住脚，建议大家重点关注。",
+    "seer": "我是预言家，昨晚查验了玩家 {t}，大家可以参考我的信息。",
+    "witch": "我这边有一些信息，玩家 {t} 的行为比较可疑，先听听大家怎么说。",
+    "hunter": "我的身份不方便说，如果我出局会给大家交代，玩家 {t} 需要解释一下。",
+    "guard": "我会保护好人，玩家 {t} 的发言前后矛盾，值得怀疑。",
+    "villager": "我是村民，目前信息不多，玩家 {t} 的发言让我有点怀疑。",
+}
+TOKEN_PATTERN = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af]|[^\u2e80-\u9fff\uac00-\ud7af]{1,4}")
+
+
+def _tokenize(text: str) -> list:
+    """按 ratelimiter.estimate_tokens 的口径切分：中日韩字符一个token，其余字符4个一个token"""
+    return TOKEN_PATTERN.findall(text)
+
+
+def _numbers(text: str) -> list:
+    return [int(n) for n in re.findall(r"-?\d+", text)]
+
+
+class ScriptedReplies:
+    """按系统提示中的身份和本次任务生成脚本化回复；同样的请求得到同样的回复"""
+
+    def reply(self, messages: list, response_format: dict = None) -> str:
+        system = "\n".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+        history = "\n".join(m.get("content") or "" for m in messages)
+        task = messages[-1].get("content") or "" if messages else ""
+        rng = random.Random(hashlib.sha256(history.encode("utf-8")).hexdigest())
+        role = next((name for name, marker in ROLE_MARKERS.items() if marker in system), "villager")
+        match = re.search(r"你的编号是(\d+)", system)
+        me = int(match.group(1)) if match else None
+        alive = self._alive(history)
+        target = rng.choice([n for n in alive if n != me] or [1])
+        schema = (response_format or {}).get("json_schema", {}).get("schema")
+        if schema:
+            return json.dumps(self._fill_schema(schema, task, history, role, me, alive, target, rng),
+                              ensure_ascii=False)
+        if '"vote"' in task:
+            fields = ["thinking", "plan", "reason", "vote"] if '"thinking"' in task else ["reason", "vote"]
+            schema = {"properties": {name: {} for name in fields}}
+            return json.dumps(self._fill_schema(schema, task, history, role, me, alive, target, rng),
+                              ensure_ascii=False)
+        if '"speech"' in task:
+            schema = {"properties": {"thinking": {}, "plan": {}, "speech": {}}}
+            return json.dumps(self._fill_schema(schema, task, history, role, me, alive, target, rng),
+                              ensure_ascii=False)
+        if "## 你的任务" in task:
+            return self._speech(task, role, target)
+        if "行动计划" in task:
+            return self._plan(target)
+        if alive:
+            return self._speech(task, role, target)
+        return "你好！我是本地模拟模型。"
+
+    @staticmethod
+    def _alive(history: str) -> list:
+        found = re.findall(r"当前存活玩家：([\d, ]+)", history) or re.findall(r"存活玩家：\[([\d, ]+)\]", history)
+        return _numbers(found[-1]) if found else []
+
+    @staticmethod
+    def _plan(target: int) -> str:
+        return f"当前信息有限，我会重点观察玩家 {target} 的发言再做决定。"
+
+    @staticmethod
+    def _speech(task: str, role: str, target: int) -> str:
+        if "遗言" in task:
+            return f"我是好人，希望大家冷静分析，玩家 {target} 很可疑。"
+        if "狼人队伍讨论" in task:
+            return f"今晚建议刀玩家 {target}。"
+        return SPEECHES[role].format(t=target)
+
+    def _vote(self, enum, task, history, role, me, alive, rng) -> int:
+        """从合法目标中选：不投自己，狼人不投队友，能投人时不弃票"""
+        choices = list(enum) if enum else None
+        if choices is None:
+            match = re.search(r"vote 只能是以下之一：\[([-\d, ]*)\]", task)
+            choices = _numbers(match.group(1)) if match else alive + [-1]
+        if choices and set(choices) <= {-1, 0, 1} and "解药" in task:
+            return rng.choice(choices)
+        teammates = []
+        if role == "werewolf":
+            found = re.findall(r"你的队友是：([\d, ]+)", history)
+            teammates = _numbers(found[-1]) if found else []
+        preferred = [c for c in choices if c not in (-1, me) and c not in teammates]
+        return rng.choice(preferred or choices or [-1])
+
+    def _fill_schema(self, schema, task, history, role, me, alive, target, rng) -> dict:
+        result = {}
+        for name, spec in schema.get("properties", {}).items():
+            if name == "vote":
+                result[name] = self._vote(spec.get("enum"), task, history, role, me, alive, rng)
+            elif name == "speech":
+                result[name] = self._speech(task, role, target)
+            elif name == "plan":
+                result[name] = self._plan(target)
+            elif name == "reason":
+                result[name] = f"玩家 {target} 的发言最可疑。"
+            else:
+                result[name] = "根据目前的发言和投票情况分析局势。"
+        return result
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持长连接，流式响应使用分块传输
+
+    def log_message(self, format, *args):
+        pass  # 压测时不逐条打印访问日志
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.stats[status] += 1
+
+    def _send_error(self, status: int, message: str, error_type: str, headers: dict = None):
+        self._send_json(status, {"error": {"message": message, "type": error_type, "code": status}}, headers)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [
+                {"id": model, "object": "model", "created": 0, "owned_by": "mock"}
+                for model in self.server.settings["models"]]})
+        else:
+            self._send_error(404, f"未知路径 {self.path}", "not_found_error")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_error(400, "请求体不是合法的 JSON", "invalid_request_error")
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_error(404, f"未知路径 {self.path}", "not_found_error")
+            return
+        settings = self.server.settings
+        if settings["api_key"] and self.headers.get("Authorization") != f"Bearer {settings['api_key']}":
+            self._send_error(401, "Incorrect API key provided", "authentication_error")
+            return
+        if request.get("model") not in settings["models"]:
+            self._send_error(404, f"The model `{request.get('model')}` does not exist", "not_found_error")
+            return
+        if request.get("response_format") and not settings["structured_output"]:
+            self._send_error(400, "response_format is not supported", "invalid_request_error")
+            return
+        if self._inject_fault():
+            return
+        text = self.server.replies.reply(request.get("messages") or [], request.get("response_format"))
+        tokens = _tokenize(text)
+        finish_reason = "stop"
+        max_tokens = request.get("max_tokens") or request.get("max_completion_tokens")
+        if max_tokens and len(tokens) > max_tokens:
+            tokens, finish_reason = tokens[:max_tokens], "length"
+        if request.get("stream"):
+            self._stream(request, tokens, finish_reason)
+        else:
+            self._complete(request, tokens, finish_reason)
+
+    def _inject_fault(self) -> bool:
+        """按配置的概率返回 429、5xx 或挂起不响应"""
+        settings = self.server.settings
+        roll = self.server.roll()
+        if roll < settings["rate_limit_rate"]:
+            self._send_error(429, "Rate limit reached, please retry later", "rate_limit_error",
+                             {"Retry-After": str(settings["retry_after"])})
+            return True
+        roll -= settings["rate_limit_rate"]
+        if roll < settings["server_error_rate"]:
+            status = self.server.pick([500, 502, 503])
+            self._send_error(status, "The server had an error while processing your request", "server_error")
+            return True
+        roll -= settings["server_error_rate"]
+        if roll < settings["timeout_rate"]:
+            self.server.stats["timeout"] += 1
+            time.sleep(settings["hang_seconds"])
+            self.close_connection = True
+            return True
+        return False
+
+    def _ttft(self) -> float:
+        settings = self.server.settings
+        return max(0.0, settings["ttft"] + self.server.uniform(-settings["ttft_jitter"], settings["ttft_jitter"]))
+
+    def _usage(self, request: dict, completion_tokens: int) -> dict:
+        prompt = "".join(m.get("content") or "" for m in request.get("messages") or [])
+        prompt_tokens = len(_tokenize(prompt))
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": 0}}
+
+    def _write_chunk(self, payload):
+        data = payload if isinstance(payload, bytes) else \
+            f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, request: dict, tokens: list, finish_reason: str):
+        settings = self.server.settings
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        base = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request.get("model")}
+        interval = 1.0 / settings["tokens_per_second"] if settings["tokens_per_second"] > 0 else 0.0
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.server.stats[200] += 1
+        time.sleep(self._ttft())
+        try:
+            self._write_chunk({**base, "choices": [
+                {"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]})
+            for _ in range(settings["reasoning_tokens"]):
+                self._write_chunk({**base, "choices": [
+                    {"index": 0, "delta": {"reasoning_content": "思"}, "finish_reason": None}]})
+                time.sleep(interval)
+            for token in tokens:
+                self._write_chunk({**base, "choices": [
+                    {"index": 0, "delta": {"content": token}, "finish_reason": None}]})
+                time.sleep(interval)
+            self._write_chunk({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]})
+            if (request.get("stream_options") or {}).get("include_usage"):
+                usage = self._usage(request, len(tokens) + settings["reasoning_tokens"])
+                self._write_chunk({**base, "choices": [], "usage": usage})
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端拿到完整答案后提前关闭了流
+            self.server.stats["closed_early"] += 1
+            self.close_connection = True
+
+    def _complete(self, request: dict, tokens: list, finish_reason: str):
+        rate = self.server.settings["tokens_per_second"]
+        time.sleep(self._ttft() + (len(tokens) / rate if rate > 0 else 0.0))
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                         "finish_reason": finish_reason}],
+            "usage": self._usage(request, len(tokens)),
+        })
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.replies = ScriptedReplies()
+        self.stats = Counter()  # {状态码或事件: 次数}
+        self._rng = random.Random(settings["seed"])
+        self._rng_lock = threading.Lock()
+        super().__init__((settings["host"], settings["port"]), MockHandler)
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return  # 客户端提前关闭连接属于正常情况
+        super().handle_error(request, client_address)
+
+    def roll(self) -> float:
+        with self._rng_lock:
+            return self._rng.random()
+
+    def uniform(self, low: float, high: float) -> float:
+        with self._rng_lock:
+            return self._rng.uniform(low, high)
+
+    def pick(self, choices: list):
+        with self._rng_lock:
+            return self._rng.choice(choices)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_mock_server(**settings) -> MockServer:
+    """在后台线程中启动模拟服务并返回；port=0 时自动选择空闲端口，地址见 server.base_url"""
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise ValueError(f"未知的模拟服务配置项: {sorted(unknown)}")
+    server = MockServer({**_settings, **settings})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟的 OpenAI 兼容服务，用于离线压测")
+    parser.add_argument("--host", default=_settings["host"])
+    parser.add_argument("--port", type=int, default=_settings["port"])
+    parser.add_argument("--models", nargs="+", default=_settings["models"], help="提供的模型名")
+    parser.add_argument("--api-key", help="设置后校验请求的 API Key")
+    parser.add_argument("--ttft", type=float, default=_settings["ttft"], help="首字延迟（秒）")
+    parser.add_argument("--ttft-jitter", type=float, default=_settings["ttft_jitter"])
+    parser.add_argument("--tps", type=float, default=_settings["tokens_per_second"], help="每秒生成的token数")
+    parser.add_argument("--reasoning-tokens", type=int, default=_settings["reasoning_tokens"])
+    parser.add_argument("--rate-limit", type=float, default=_settings["rate_limit_rate"], help="返回429的概率")
+    parser.add_argument("--retry-after", type=float, default=_settings["retry_after"])
+    parser.add_argument("--server-error", type=float, default=_settings["server_error_rate"], help="返回5xx的概率")
+    parser.add_argument("--timeout", type=float, default=_settings["timeout_rate"], help="挂起不响应的概率")
+    parser.add_argument("--hang-seconds", type=float, default=_settings["hang_seconds"])
+    parser.add_argument("--no-structured-output", action="store_true", help="拒绝带 response_format 的请求")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    server = MockServer({
+        **_settings,
+        "host": args.host, "port": args.port, "models": args.models, "api_key": args.api_key,
+        "ttft": args.ttft, "ttft_jitter": args.ttft_jitter, "tokens_per_second": args.tps,
+        "reasoning_tokens": args.reasoning_tokens, "rate_limit_rate": args.rate_limit,
+        "retry_after": args.retry_after, "server_error_rate": args.server_error,
+        "timeout_rate": args.timeout, "hang_seconds": args.hang_seconds,
+        "structured_output": not args.no_structured_output, "seed": args.seed,
+    })
+    print(f"模拟服务已启动：{server.base_url}，模型：{', '.join(args.models)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("请求统计：", dict(server.stats))
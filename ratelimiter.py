@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中日韩字符按1个token，其余字符按4个字符1个token"""
+    cjk = sum(1 for ch in text if '\u2e80' <= ch <= '\u9fff' or '\uac00' <= ch <= '\ud7af')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class TokenBucket:
+    """令牌桶：容量为每分钟额度，按秒匀速补充；允许透支，透支部分换算成等待时间"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """预留额度，返回需要等待的秒数（额度充足时为0）"""
+        self._refill(now)
+        # 单次请求超过整桶容量时按整桶计，避免永远等不到
+        self.tokens -= min(amount, self.capacity)
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def resize(self, per_minute: int, now: float):
+        """修改每分钟额度，保留当前剩余（或透支）的额度，不重新填满"""
+        self._refill(now)
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = min(self.tokens, self.capacity)
+
+    def adjust(self, amount: float, now: float):
+        """请求结束后按实际用量补扣（amount 为负则返还）"""
+        self._refill(now)
+        self.tokens -= amount
+
+
+class RateLimiter:
+    """单个 (api_base, api_key) 的 RPM/TPM 限流器，由使用该端点的所有玩家共享。
+    未配置的维度不限流；只有额度真正耗尽时才会等待。"""
+
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None):
+        self._lock = threading.Lock()
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = TokenBucket(rpm) if rpm else None
+        self._tokens = TokenBucket(tpm) if tpm else None
+
+    def configure(self, rpm: Optional[int] = None, tpm: Optional[int] = None):
+        """更新额度配置。每个玩家创建时都会登记一次端点，额度不变时什么都不做；
+        额度变化时沿用已用掉的部分，否则对局进行中再创建玩家就会凭空多出一分钟的额度"""
+        with self._lock:
+            now = time.monotonic()
+            self._requests = self._resize(self._requests, self.rpm, rpm, now)
+            self._tokens = self._resize(self._tokens, self.tpm, tpm, now)
+            self.rpm = rpm
+            self.tpm = tpm
+
+    @staticmethod
+    def _resize(bucket: Optional[TokenBucket], old: Optional[int], new: Optional[int],
+                now: float) -> Optional[TokenBucket]:
+        if new == old:
+            return bucket
+        if not new:
+            return None
+        if bucket is None:
+            return TokenBucket(new)
+        bucket.resize(new, now)
+        return bucket
+
+    def reserve(self, tokens: int = 0) -> float:
+        """为一次请求预留额度，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            delay = 0.0
+            if self._requests is not None:
+                delay = max(delay, self._requests.reserve(1, now))
+            if self._tokens is not None and tokens:
+                delay = max(delay, self._tokens.reserve(tokens, now))
+            return delay
+
+    def acquire(self, tokens: int = 0):
+        """同步等待额度"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens: int = 0):
+        """异步等待额度，不阻塞事件循环"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record_usage(self, tokens: int):
+        """请求完成后扣除预留时未计入的用量（如输出token）"""
+        if self._tokens is None or not tokens:
+            return
+        with self._lock:
+            self._tokens.adjust(tokens, time.monotonic())
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_base: str, api_key: str,
+                     rpm: Optional[int] = None, tpm: Optional[int] = None) -> RateLimiter:
+    """获取端点共享的限流器；传入 rpm/tpm 时更新该端点的额度配置"""
+    key = (api_base, api_key)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(rpm, tpm)
+            _limiters[key] = limiter
+        elif rpm is not None or tpm is not None:
+            limiter.configure(rpm if rpm is not None else limiter.rpm,
+                              tpm if tpm is not None else limiter.tpm)
+        return limiter
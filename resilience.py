@@ -0,0 +1,148 @@
+import email.utils
+import random
+import threading
+import time
+from typing import Dict, Optional, Tuple
+import openai
+
+try:
+    import httpx
+except ImportError:  # 较新版本的 openai 依赖 httpx2
+    import httpx2 as httpx
+
+# 错误分类
+RETRY = "retry"        # 限流、超时、连接失败、5xx：退避后重试
+ENDPOINT = "endpoint"  # 密钥无效、无权限、模型不存在：端点不可用，不重试并立即熔断
+REQUEST = "request"    # 请求本身有误（如参数错误）：不重试，端点视为正常
+
+# 退避与熔断配置，可通过 config.json 的 "resilience" 覆盖
+_settings = {
+    "base_delay": 1.0,         # 首次重试的退避上限（秒），之后按2倍增长
+    "max_delay": 30.0,         # 单次退避上限（秒）
+    "failure_threshold": 5,    # 连续失败多少次后熔断
+    "reset_timeout": 30.0,     # 熔断多少秒后放行一个探测请求
+}
+
+
+def configure_resilience(**settings):
+    """更新退避与熔断配置"""
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise ValueError(f"未知的重试/熔断配置项: {sorted(unknown)}")
+    _settings.update(settings)
+
+
+def classify_error(exc: Exception) -> str:
+    """按异常类型判断是否值得重试，与 access_api_demo 的区分方式一致"""
+    if isinstance(exc, (openai.AuthenticationError, openai.PermissionDeniedError, openai.NotFoundError)):
+        return ENDPOINT
+    if isinstance(exc, (openai.BadRequestError, openai.UnprocessableEntityError)):
+        return REQUEST
+    if isinstance(exc, openai.APIStatusError):
+        # 408/409/429 与 5xx 是暂时性错误，其余 4xx 重试也没有意义
+        status = exc.status_code
+        return RETRY if status >= 500 or status in (408, 409, 429) else REQUEST
+    # 超时、连接错误以及流式读取中途断开等都按暂时性错误处理
+    return RETRY
+
+
+def retry_after(exc: Exception) -> Optional[float]:
+    """读取服务端建议的等待秒数（Retry-After / retry-after-ms），没有则返回 None"""
+    response = getattr(exc, "response", None)
+    if not isinstance(response, httpx.Response):
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            # HTTP 日期格式
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, exc: Exception = None) -> float:
+    """第 attempt 次（从0开始）失败后的等待秒数：指数退避加全抖动，服务端给了 Retry-After 时以其为下限"""
+    cap = min(_settings["max_delay"], _settings["base_delay"] * (2 ** attempt))
+    delay = random.uniform(0, cap)
+    hint = retry_after(exc) if exc is not None else None
+    if hint is not None:
+        delay = max(delay, min(hint, _settings["max_delay"]))
+    return delay
+
+
+class CircuitBreaker:
+    """单个 (api_base, api_key) 的熔断器，由使用该端点的所有玩家共享。
+    连续失败达到阈值后熔断，熔断期间请求直接失败；冷却后放行一个探测请求，成功则恢复。"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = None, reset_timeout: float = None):
+        self.failure_threshold = failure_threshold or _settings["failure_threshold"]
+        self.reset_timeout = reset_timeout or _settings["reset_timeout"]
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """当前是否可以向该端点发请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            # 半开状态同一时间只放行一个探测请求
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self, trip: bool = False):
+        """记录一次端点故障；trip=True 时（如密钥无效）立即熔断"""
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if trip or self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def available(self) -> bool:
+        """不改变状态地判断端点是否可用（供路由选择时参考）"""
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at >= self.reset_timeout
+            return not (self.state == self.HALF_OPEN and self._probing)
+
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(api_base: str, api_key: str) -> CircuitBreaker:
+    """获取端点共享的熔断器"""
+    key = (api_base, api_key)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker()
+            _breakers[key] = breaker
+        return breaker
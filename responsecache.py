@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+PASSTHROUGH = "passthrough"  # 不读不写，每次都请求模型
+RECORD = "record"            # 命中时直接返回，未命中时请求模型并写入缓存
+REPLAY = "replay"            # 只读缓存，未命中时报错，不发出任何请求
+MODES = (PASSTHROUGH, RECORD, REPLAY)
+
+# 模型回复缓存配置，可通过 config.json 的 "response_cache" 覆盖；默认不启用
+_settings = {
+    "mode": PASSTHROUGH,
+    "path": ".llm_cache",          # 缓存目录，每条回复一个文件
+    "max_bytes": 256 * 1024 * 1024,  # 缓存总大小上限，超出后淘汰最久未使用的条目
+}
+
+
+class CacheMiss(LookupError):
+    """回放模式下请求的内容不在缓存中（对局走向与录制时不同）"""
+
+
+def configure_response_cache(**settings):
+    """更新模型回复缓存配置"""
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise ValueError(f"未知的回复缓存配置项: {sorted(unknown)}")
+    if settings.get("mode", PASSTHROUGH) not in MODES:
+        raise ValueError(f"回复缓存模式应为 {MODES} 之一: {settings['mode']}")
+    global _cache
+    with _cache_lock:
+        _settings.update(settings)
+        _cache = None  # 目录或上限可能变了，下次使用时重新加载
+
+
+def cache_key(model: str, messages: list, temperature: float, max_tokens: int,
+              seed: int = None, response_format: dict = None) -> str:
+    """按请求内容计算的缓存键"""
+    payload = json.dumps([model, messages, temperature, max_tokens, seed, response_format],
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """磁盘上的模型回复缓存：按最近使用顺序淘汰，使用顺序通过文件修改时间在多次运行间保留"""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # {键: 文件大小}，最久未使用的在前
+        self._total = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        files = []
+        for name in os.listdir(path):
+            if name.endswith(".json"):
+                stat = os.stat(os.path.join(path, name))
+                files.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total += size
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key + ".json")
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            try:
+                with open(self._file(key), "r", encoding="utf-8") as f:
+                    response = json.load(f)["response"]
+                os.utime(self._file(key))
+            except (OSError, ValueError, KeyError):
+                # 文件被外部删除或损坏，按未命中处理
+                self._total -= self._entries.pop(key)
+                return None
+            return response
+
+    def put(self, key: str, model: str, response: str):
+        data = json.dumps({"model": model, "response": response}, ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            tmp = self._file(key) + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._file(key))
+            self._total += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._total -= size
+                try:
+                    os.remove(self._file(old_key))
+                except OSError:
+                    pass
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def _get_cache() -> Optional[ResponseCache]:
+    global _cache
+    if _settings["mode"] == PASSTHROUGH:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(_settings["path"], _settings["max_bytes"])
+        return _cache
+
+
+def lookup_response(key: str) -> Optional[str]:
+    """查找缓存的回复；回放模式下未命中时抛出 CacheMiss"""
+    cache = _get_cache()
+    if cache is None:
+        return None
+    response = cache.get(key)
+    if response is None and _settings["mode"] == REPLAY:
+        raise CacheMiss(f"回放模式下缓存未命中: {key}")
+    return response
+
+
+def store_response(key: str, model: str, response: str):
+    """录制模式下写入一条回复"""
+    cache = _get_cache()
+    if cache is not None and _settings["mode"] == RECORD:
+        cache.put(key, model, response)
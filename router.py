@@ -0,0 +1,129 @@
+import random
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from clientpool import get_async_client, get_client
+from ratelimiter import get_rate_limiter
+from resilience import get_circuit_breaker
+
+
+class Endpoint:
+    """一个 (api_base, api_key) 端点：共享的客户端、限流器、熔断器，以及在途请求数和首字延迟"""
+
+    LATENCY_SMOOTHING = 0.3  # 首字延迟指数滑动平均的权重
+
+    def __init__(self, api_base: str, api_key: str, rpm: int = None, tpm: int = None):
+        self.api_base = api_base
+        self.api_key = api_key
+        self.rate_limiter = get_rate_limiter(api_base, api_key, rpm, tpm)
+        self.circuit_breaker = get_circuit_breaker(api_base, api_key)
+        self.outstanding = 0   # 正在进行中的请求数
+        self.latency = None    # 首字延迟的滑动平均（秒），还没有样本时为 None
+        self.unsupported = set()  # 该端点不接受的可选请求参数（如 response_format、stream_options）
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        return get_client(self.api_base, self.api_key)
+
+    @property
+    def async_client(self):
+        """当前事件循环内该端点共享的异步客户端"""
+        return get_async_client(self.api_base, self.api_key)
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            if self.latency is None:
+                self.latency = seconds
+            else:
+                self.latency += self.LATENCY_SMOOTHING * (seconds - self.latency)
+
+    def begin(self):
+        """请求开始，计入在途数"""
+        with self._lock:
+            self.outstanding += 1
+
+    def end(self):
+        with self._lock:
+            self.outstanding -= 1
+
+
+class ModelRouter:
+    """把同一模型的请求分摊到所有提供该模型的端点。
+    按 (在途请求数 + 1) × 首字延迟 选择负载最轻的端点，跳过已熔断的端点，实现自动故障转移。"""
+
+    TTFT_WINDOW = 200  # 保留最近多少次首字延迟，供对冲请求计算分位数
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.endpoints: List[Endpoint] = []
+        self.ttft_samples = deque(maxlen=self.TTFT_WINDOW)  # 该模型最近的首字延迟（秒）
+        self._lock = threading.Lock()
+
+    def add_endpoint(self, endpoint: "Endpoint"):
+        with self._lock:
+            if endpoint not in self.endpoints:
+                self.endpoints.append(endpoint)
+
+    def record_latency(self, endpoint: Endpoint, seconds: float):
+        """记录一次首字延迟"""
+        endpoint.record_latency(seconds)
+        with self._lock:
+            self.ttft_samples.append(seconds)
+
+    def ttft_percentile(self, percentile: float, min_samples: int = 1) -> Optional[float]:
+        """最近首字延迟的分位数，样本不足时返回 None"""
+        with self._lock:
+            samples = sorted(self.ttft_samples)
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+    def _score(self, endpoint: Endpoint, default_latency: float) -> float:
+        latency = endpoint.latency if endpoint.latency is not None else default_latency
+        return (endpoint.outstanding + 1) * latency
+
+    def pick(self, exclude=()) -> Optional[Endpoint]:
+        """选出当前最合适的端点；优先避开本次请求已失败过的端点，没有可用端点时返回 None"""
+        with self._lock:
+            endpoints = list(self.endpoints)
+        available = [e for e in endpoints if e.circuit_breaker.available()]
+        candidates = [e for e in available if e not in exclude] or available
+        if not candidates:
+            return None
+        # 没有延迟样本的端点按已知端点的平均值估计，全都没有时退化为最少在途请求
+        known = [e.latency for e in endpoints if e.latency is not None]
+        default_latency = sum(known) / len(known) if known else 1.0
+        best = min(self._score(e, default_latency) for e in candidates)
+        return _rng.choice([e for e in candidates if self._score(e, default_latency) == best])
+
+
+_rng = random.Random()  # 独立的随机源，不影响对局使用的全局随机数
+_endpoints: Dict[Tuple[str, str], Endpoint] = {}
+_routers: Dict[str, ModelRouter] = {}
+_registry_lock = threading.Lock()
+
+
+def register_endpoint(model_name: str, api_base: str, api_key: str,
+                      rpm: int = None, tpm: int = None, structured_output: bool = None) -> Endpoint:
+    """登记一个提供 model_name 的端点；同一 (api_base, api_key) 只创建一次，可服务多个模型。
+    structured_output=False 表示该端点不支持 response_format，不必尝试"""
+    key = (api_base, api_key)
+    with _registry_lock:
+        endpoint = _endpoints.get(key)
+        if endpoint is None:
+            endpoint = Endpoint(api_base, api_key, rpm, tpm)
+            _endpoints[key] = endpoint
+        elif rpm is not None or tpm is not None:
+            get_rate_limiter(api_base, api_key, rpm, tpm)  # 更新额度配置
+        if structured_output is False:
+            endpoint.unsupported.add("response_format")
+        router = _routers.setdefault(model_name, ModelRouter(model_name))
+    router.add_endpoint(endpoint)
+    return endpoint
+
+
+def get_router(model_name: str) -> ModelRouter:
+    """获取模型对应的路由器"""
+    with _registry_lock:
+        return _routers.setdefault(model_name, ModelRouter(model_name))
@@ -0,0 +1,63 @@
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from experiencepool import ExperiencePool
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_GAMES = sorted(glob.glob(os.path.join(REPO_DIR, "game_2025*")))  # 仓库自带的历史对局
+
+
+class IncrementalIndexTest(unittest.TestCase):
+    """增量加入对局并重算IDF后，检索结果应与对同一目录从头建立的经验池一致"""
+
+    def setUp(self):
+        if len(SAMPLE_GAMES) < 2:
+            self.skipTest("缺少示例对局")
+        self.tmp = tempfile.mkdtemp()
+        self.experience_dir = os.path.join(self.tmp, "chat_logs")
+        os.makedirs(self.experience_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _copy_game(self, game_path: str) -> str:
+        target = os.path.join(self.experience_dir, os.path.basename(game_path))
+        shutil.copytree(game_path, target)
+        return target
+
+    def test_add_game_then_reweight_matches_fresh_pool(self):
+        half = len(SAMPLE_GAMES) // 2
+        for game_path in SAMPLE_GAMES[:half]:
+            self._copy_game(game_path)
+        incremental = ExperiencePool(self.experience_dir, snapshot_dir=os.path.join(self.tmp, "index_a"))
+        added = sum(incremental.add_game(self._copy_game(game_path)) for game_path in SAMPLE_GAMES[half:])
+        self.assertGreater(added, 0)
+        incremental.reweight_idf()
+        fresh = ExperiencePool(self.experience_dir, snapshot_dir=os.path.join(self.tmp, "index_b"))
+
+        self.assertEqual([e["context"] for e in incremental.experiences],
+                         [e["context"] for e in fresh.experiences])
+        # 每个 (角色, 类型) 取几条已有经验的上下文作为查询
+        queries = {}
+        for exp in fresh.experiences:
+            queries.setdefault((exp["role"], exp["type"]), []).append(exp["context"])
+        contexts, roles, types = [], [], []
+        for (role, exp_type), texts in queries.items():
+            for text in texts[:3]:
+                contexts.append(text)
+                roles.append(role)
+                types.append(exp_type)
+        expected = fresh.retrieve_many(contexts, roles, types, top_k=5)
+        actual = incremental.retrieve_many(contexts, roles, types, top_k=5)
+        for want, got in zip(expected, actual):
+            self.assertEqual([e["context"] for e in got], [e["context"] for e in want])
+            np.testing.assert_allclose([e["similarity"] for e in got], [e["similarity"] for e in want])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import resilience
+from main import Game, LLMPlayer
+from mockserver import start_mock_server
+
+
+class MockGameSmokeTest(unittest.TestCase):
+    """用本地模拟服务跑完整局游戏：无需真实模型和网络，检查对局能正常结束并保存记录"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)  # 聊天记录和经验池写在临时目录
+        self.resilience_settings = dict(resilience._settings)
+        resilience.configure_resilience(base_delay=0.05, max_delay=0.2)
+        self.server = start_mock_server(port=0, ttft=0.01, ttft_jitter=0.0, tokens_per_second=5000,
+                                        rate_limit_rate=0.05, server_error_rate=0.05, retry_after=0.05, seed=1)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        resilience._settings.update(self.resilience_settings)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_game_runs_to_completion(self):
+        players = [LLMPlayer(None, self.server.base_url, "mock-model", "k", max_retries=4) for _ in range(9)]
+        game = Game(players, seed=7)
+        for p in players:
+            p.display = None
+        finished = False
+        while not finished and game.day < 20:
+            finished = game.updateDay()
+        self.assertTrue(finished)
+        self.assertGreater(self.server.stats[200], 0)
+        self.assertGreater(self.server.stats[429] + sum(self.server.stats[s] for s in (500, 502, 503)), 0)
+        game_dirs = [d for d in os.listdir("chat_logs") if d.startswith("game_")]
+        self.assertEqual(len(game_dirs), 1)
+        self.assertTrue(os.path.exists(os.path.join("chat_logs", game_dirs[0], "game_summary.txt")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from Enums import GameState, Role
+from asyncengine import AsyncGame, AsyncLLMPlayer
+from main import Game, LLMPlayer
+
+SEER_DELAY = 0.3  # 预言家比狼人慢得多（重试、慢端点等）
+
+
+def _choose(player, choices):
+    """脚本化的投票：狼人袭击第一个候选，女巫不用药，预言家查验第一个合法目标"""
+    if player.role == Role.WITCH:
+        return 0 if choices == [0, 1] else -1
+    return choices[0]
+
+
+class SlowSeerPlayer(LLMPlayer):
+    """不请求模型的AI玩家；预言家行动时记录它请求期间看到的存活名单"""
+
+    def requestSpeech(self, prompt: str) -> str:
+        return "过。"
+
+    def requestVote(self, prompt: str, valid_targets: list = None) -> int:
+        if self.role == Role.SEER:
+            time.sleep(SEER_DELAY)
+            self.seen_alive = [p.number for p in self.game.getAlivePlayers()]
+        return _choose(self, valid_targets)
+
+
+class AsyncSlowSeerPlayer(AsyncLLMPlayer):
+    async def requestSpeech(self, prompt: str) -> str:
+        return "过。"
+
+    async def requestVote(self, prompt: str, valid_targets: list = None) -> int:
+        if self.role == Role.SEER:
+            await asyncio.sleep(SEER_DELAY)
+            self.seen_alive = [p.number for p in self.game.getAlivePlayers()]
+        return _choose(self, valid_targets)
+
+
+class NightPhaseTest(unittest.TestCase):
+    """夜间并发行动时，预言家的请求不能提前看到当晚的死亡（女巫行动会修改存活名单）"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)  # 经验池读写临时目录
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _start_night(self, game_cls, player_cls):
+        game = game_cls([player_cls(None, "http://127.0.0.1:9/v1", "stub-model", "k") for _ in range(9)], seed=3)
+        game.day = 1
+        game.state = GameState.NIGHT
+        game.night_deaths = []
+        return game
+
+    def _check(self, game):
+        seer = next(p for p in game.players if p.role == Role.SEER)
+        self.assertEqual(seer.seen_alive, list(range(1, 10)))
+        self.assertEqual(len(game.night_deaths), 1)  # 袭击仍然生效
+
+    def test_slow_seer_does_not_see_tonights_deaths(self):
+        game = self._start_night(Game, SlowSeerPlayer)
+        game._run_steps(game._night_phase())
+        self._check(game)
+
+    def test_slow_seer_does_not_see_tonights_deaths_async(self):
+        game = self._start_night(AsyncGame, AsyncSlowSeerPlayer)
+        asyncio.run(game._arun_steps(game._night_phase()))
+        self._check(game)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import openai
+
+try:
+    import httpx
+except ImportError:  # 较新版本的 openai 依赖 httpx2
+    import httpx2 as httpx
+
+from main import LLMCall, LLMPlayer
+
+
+def _bad_request(message: str, param: str = None) -> openai.BadRequestError:
+    response = httpx.Response(400, request=httpx.Request("POST", "http://127.0.0.1:9/v1/chat/completions"))
+    body = {"message": message, "type": "invalid_request_error", "param": param}
+    return openai.BadRequestError(message, response=response, body=body)
+
+
+class OptionalParamsTest(unittest.TestCase):
+    """只有错误指明了某个可选参数时才把它记为端点不支持"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        # 每个用例使用独立的端点，避免 unsupported 在用例之间残留
+        self.player = LLMPlayer(None, f"http://127.0.0.1:9/{self.id()}", "stub-model", "k")
+        self.endpoint = self.player.router.endpoints[-1]
+        self.schema = self.player._vote_schema([1, 2])
+        self.call = LLMCall([{"role": "user", "content": "投票"}], "key", "vote", self.schema)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_unrelated_400_keeps_optional_params(self):
+        error = _bad_request("This model's maximum context length is 8192 tokens")
+        self.assertFalse(self.player._option_rejected(self.endpoint, self.schema, error))
+        self.assertFalse(self.player._call_failed(self.call, self.endpoint, error, attempt=0))
+        self.assertEqual(self.endpoint.unsupported, set())
+        options = self.player._request_options(self.endpoint, 16, self.schema)
+        self.assertIn("response_format", options)
+        self.assertIn("stream_options", options)
+
+    def test_400_naming_a_param_drops_only_that_param(self):
+        error = _bad_request("Invalid request", param="stream_options")
+        self.assertTrue(self.player._option_rejected(self.endpoint, self.schema, error))
+        self.assertEqual(self.endpoint.unsupported, {"stream_options"})
+
+        error = _bad_request("response_format is not supported")
+        self.assertTrue(self.player._option_rejected(self.endpoint, self.schema, error))
+        self.assertEqual(self.endpoint.unsupported, {"stream_options", "response_format"})
+
+
+if __name__ == "__main__":
+    unittest.main()
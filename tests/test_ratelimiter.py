@@ -0,0 +1,28 @@
+import unittest
+
+from ratelimiter import RateLimiter, get_rate_limiter
+
+
+class RateLimiterTest(unittest.TestCase):
+    """重复登记同一端点（每创建一个玩家一次）不能重置已用掉的额度"""
+
+    def test_reregistering_keeps_used_budget(self):
+        limiter = get_rate_limiter("http://127.0.0.1:9/ratelimiter-test", "k", rpm=2)
+        self.assertEqual(limiter.reserve(), 0.0)
+        self.assertEqual(limiter.reserve(), 0.0)
+        get_rate_limiter("http://127.0.0.1:9/ratelimiter-test", "k", rpm=2)
+        self.assertGreater(limiter.reserve(), 25.0)
+
+    def test_changing_rpm_keeps_fill_level(self):
+        limiter = RateLimiter(rpm=2)
+        limiter.reserve()
+        limiter.reserve()
+        limiter.configure(rpm=4)
+        # 额度已用完，提高上限后按新的补充速度（每 15 秒一个）等待，而不是立即放行
+        self.assertGreater(limiter.reserve(), 10.0)
+        limiter.configure(rpm=None)
+        self.assertEqual(limiter.reserve(), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from main import Game, LLMPlayer
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class GameSeedTest(unittest.TestCase):
+    """同一随机种子复现角色分配和各玩家的问题抽取，种子写入对局总结"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        shutil.copy(os.path.join(REPO_DIR, "question.json"), self.tmp)  # 使用完整问题库，抽题才有随机性
+        os.chdir(self.tmp)  # 聊天记录和经验池写在临时目录
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _new_game(self, seed: int) -> Game:
+        players = [LLMPlayer(None, "http://127.0.0.1:9/v1", "stub-model", "k") for _ in range(9)]
+        game = Game(players, seed=seed)
+        game.day = 1
+        return game
+
+    def test_same_seed_reproduces_roles_and_questions(self):
+        first, second = self._new_game(7), self._new_game(7)
+        self.assertEqual([p.role for p in first.players], [p.role for p in second.players])
+        for a, b in zip(first.players, second.players):
+            self.assertEqual(a._get_random_questions(2), b._get_random_questions(2))
+
+    def test_seed_is_recorded_in_summary(self):
+        game = self._new_game(7)
+        game_dir = game.save_chat_logs()
+        with open(os.path.join(game_dir, "game_summary.txt"), encoding="utf-8") as f:
+            self.assertIn("随机种子: 7", f.read())
+
+
+if __name__ == "__main__":
+    unittest.main()